@@ -1,21 +1,29 @@
 import json
-import boto3
 import os
 import urllib.request
 import urllib.parse
 import base64
 import logging
 import re
+import time
+import heapq
+from bisect import bisect_left, bisect_right
 from typing import Dict, List, Any
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
+
+from confluence_extraction import character_trigrams
+from confluence_local import bedrock_client_from_env, s3_client_from_env
+from confluence_profiler import profile_handler
+from confluence_sessions import new_session, session_store_from_env, valid_session_id
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize AWS clients
-bedrock_client = boto3.client('bedrock-runtime')
-s3_client = boto3.client('s3')
+bedrock_client = bedrock_client_from_env()
+s3_client = s3_client_from_env()
 
 # Configuration - all from environment variables
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
@@ -24,6 +32,68 @@ CONFLUENCE_BASE_URL = os.getenv("CONFLUENCE_BASE_URL")
 CONFLUENCE_API_TOKEN = os.getenv("CONFLUENCE_API_TOKEN")
 CONFLUENCE_USERNAME = os.getenv("CONFLUENCE_USERNAME")
 
+# Retrieval configuration - stage 1 keeps RETRIEVAL_CANDIDATES ids, the reranker returns RETRIEVAL_TOP_K
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "50"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# Weights for the reranker features, e.g. {"title": 1.0, "freshness": 0.1}; missing keys use the defaults
+DEFAULT_RERANK_WEIGHTS = {'lexical': 1.0, 'title': 0.6, 'proximity': 0.5, 'freshness': 0.2, 'space': 0.2}
+RERANK_WEIGHTS = {**DEFAULT_RERANK_WEIGHTS, **json.loads(os.getenv("RERANK_WEIGHTS", "{}"))}
+FRESHNESS_HALF_LIFE_DAYS = float(os.getenv("FRESHNESS_HALF_LIFE_DAYS", "180"))
+# Per-space prior in [0, 1], e.g. {"ENG": 1.0, "ARCHIVE": 0.0}; unlisted spaces get 0.5
+SPACE_PRIORS = json.loads(os.getenv("SPACE_PRIORS", "{}"))
+
+# Typo tolerance - query words missing from the vocabulary expand to close spellings via trigram postings
+TYPO_EXPANSION = os.getenv("TYPO_EXPANSION", "true").lower() in ("1", "true", "yes")
+EXPANSION_MAX_DISTANCE = int(os.getenv("EXPANSION_MAX_DISTANCE", "2"))
+EXPANSION_MAX_TERMS = int(os.getenv("EXPANSION_MAX_TERMS", "2"))
+# Candidates (most shared trigrams first) checked with edit distance per unknown word
+EXPANSION_MAX_CANDIDATES = int(os.getenv("EXPANSION_MAX_CANDIDATES", "100"))
+# Longest suffix a prefix variant may add, e.g. onboard -> onboarding
+PREFIX_MAX_EXTRA_CHARS = 4
+# How long a container keeps confluence-trigrams.json before reloading it
+TRIGRAM_CACHE_SECONDS = int(os.getenv("TRIGRAM_CACHE_SECONDS", "300"))
+# How long a missing or mismatched filter index is remembered before it is fetched again
+FILTER_RETRY_SECONDS = int(os.getenv("FILTER_RETRY_SECONDS", "60"))
+
+# Conversation configuration
+# Reuse the previous turn's passages when they contain at least this fraction of the follow-up's keywords
+SESSION_REUSE_COVERAGE = float(os.getenv("SESSION_REUSE_COVERAGE", "0.6"))
+# Keywords of the last standalone question added to a follow-up's search query
+SESSION_MAX_CARRIED_TERMS = int(os.getenv("SESSION_MAX_CARRIED_TERMS", "5"))
+# Add Bedrock cache_control breakpoints after the static prompt prefix (model must support prompt caching)
+BEDROCK_PROMPT_CACHE = os.getenv("BEDROCK_PROMPT_CACHE", "false").lower() in ("1", "true", "yes")
+PROMPT_PASSAGE_CHARS = 1000
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'about', 'also', 'can', 'do', 'does', 'for', 'how', 'i', 'in', 'is', 'it',
+    'of', 'on', 'or', 'our', 'so', 'that', 'the', 'then', 'these', 'this', 'those', 'to', 'we', 'what',
+    'when', 'where', 'which', 'who', 'why', 'with', 'you', 'me', 'my', 'there', 'they', 'them', 'be'
+}
+# A question opening like this continues the previous one
+CONTINUATION_PATTERN = re.compile(r'^\s*(and|also|or|but|what about|how about|same for|then)\b', re.IGNORECASE)
+# A question using these with at most REFERENCE_MAX_KEYWORDS content words refers back to an earlier turn
+REFERENCE_PATTERN = re.compile(r'\b(it|that|this|those|them|these)\b', re.IGNORECASE)
+REFERENCE_MAX_KEYWORDS = 2
+
+# auto = sync-time summaries for broad questions and raw passages for detail questions; summary / raw force one
+PROMPT_CONTEXT_MODE = os.getenv("PROMPT_CONTEXT_MODE", "auto")
+BROAD_QUESTION_PATTERN = re.compile(
+    r'\b(what is|what are|what does|overview|summar\w*|explain|tell me about|describe|purpose of|who owns|why)\b',
+    re.IGNORECASE)
+DETAIL_QUESTION_PATTERN = re.compile(
+    r'\d|["`]|\b(how (do|can) i|how to|command|steps?|exact|config\w*|setting|port|version|error|url|endpoint|'
+    r'parameter|flag|value|limit)\b|\w[._/]\w',
+    re.IGNORECASE)
+
+SYSTEM_PROMPT = """Based on the following Confluence documentation, please answer the user's question. 
+If the information isn't available in the provided context, please say so."""
+
+session_store = session_store_from_env(s3_client, S3_BUCKET)
+trigram_cache = {'loaded_at': 0.0, 'index': None}
+filter_cache = {'loaded_at': 0.0, 'index_etag': None, 'index': None}
+# Set bit positions for every byte value, used to walk filter bitmaps
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+@profile_handler("confluence-ai-query")
 def lambda_handler(event, context):
     """
     Main Lambda handler - Handles Lambda console, API Gateway, and frontend requests
@@ -63,13 +133,19 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Server configuration error: S3_BUCKET_NAME not set'})
             }
 
-        # ✅ Extract query from different sources
+        # ✅ Extract query, optional metadata filters and session id from different sources
+        filters = None
+        session_id = None
         if "query" in event:
             query = event["query"]
+            filters = event.get("filters")
+            session_id = event.get("session_id")
         elif "body" in event:
             try:
                 body = json.loads(event["body"]) if isinstance(event["body"], str) else event["body"]
                 query = body.get("query", "")
+                filters = body.get("filters")
+                session_id = body.get("session_id")
             except:
                 query = ""
         else:
@@ -82,13 +158,62 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Query parameter is required'})
             }
 
-        logger.info(f"Processing query: {query}")
+        try:
+            filters = normalize_filters(filters)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({'error': f'Invalid filters: {str(e)}'})
+            }
 
-        # Step 1: Search through stored Confluence content
-        search_results = search_confluence_content(query)
+        if session_id is not None and not valid_session_id(session_id):
+            return {
+                'statusCode': 400,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({'error': 'session_id must be 8-64 letters, digits, "-" or "_"'})
+            }
+
+        logger.info(f"Processing query: {query} (filters: {filters}, session: {session_id})")
+        # Structured line picked up by confluence-workload-replay.py record
+        logger.info("QUERY_WORKLOAD " + json.dumps({
+            'timestamp': time.time(),
+            'query': query,
+            'filters': filters,
+            'session_id': session_id
+        }))
+        session = (session_store.get(session_id) or new_session()) if session_id else None
+        history = session['turns'] if session else []
+
+        # Step 1: Rewrite follow-ups into standalone queries and search, reusing
+        # the previous turn's passages when they still cover the question
+        stage_timings = {}
+        started = time.perf_counter()
+        search_query = rewrite_query(query, history)
+        if session and passages_cover(query, session, filters):
+            search_results = session['passages']
+            retrieval = 'reused'
+        else:
+            search_results = [
+                {**result, 'content': result['content'][:PROMPT_PASSAGE_CHARS]}
+                for result in search_confluence_content(search_query, filters, stage_timings)
+            ]
+            retrieval = 'fresh'
+        retrieval_ms = (time.perf_counter() - started) * 1000
 
         # Step 2: Generate AI response using Bedrock
-        ai_response = generate_ai_response(query, search_results)
+        started = time.perf_counter()
+        context_mode = choose_context_mode(query)
+        ai_response, usage = generate_ai_response(query, search_results, history, context_mode)
+        generation_ms = (time.perf_counter() - started) * 1000
+
+        if session is not None:
+            session_store.save_turn(session_id, session, {
+                'query': query,
+                'search_query': search_query,
+                'topic': turn_topic(query, history),
+                'answer': ai_response
+            }, search_results, filters)
 
         # Step 3: Return response
         return {
@@ -96,6 +221,17 @@ def lambda_handler(event, context):
             'headers': CORS_HEADERS,
             'body': json.dumps({
                 'query': query,
+                'search_query': search_query,
+                'filters': filters,
+                'session_id': session_id,
+                'retrieval': retrieval,
+                'context_mode': context_mode,
+                'usage': usage,
+                'timings_ms': {
+                    'retrieval': round(retrieval_ms, 1),
+                    'generation': round(generation_ms, 1),
+                    **{stage: round(ms, 2) for stage, ms in stage_timings.items()}
+                },
                 'answer': ai_response,
                 'sources': [
                     {
@@ -116,63 +252,527 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': f'Internal server error: {str(e)}'})
         }
 
-def search_confluence_content(query: str) -> List[Dict]:
+def normalize_filters(filters) -> Dict:
+    """
+    Validate request filters and normalize them to lower-cased value lists.
+    Accepted keys: space, labels, author (string or list - any value matches)
+    and last_modified ({"from": iso, "to": iso}, either bound optional).
+    Different keys are combined with AND.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+
+    unknown = set(filters) - {'space', 'labels', 'author', 'last_modified'}
+    if unknown:
+        raise ValueError(f"unsupported filter keys: {', '.join(sorted(unknown))}")
+
+    normalized = {}
+    for key in ('space', 'labels', 'author'):
+        value = filters.get(key)
+        if value in (None, '', []):
+            continue
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{key} must be a string or a list of strings")
+        values = [v.strip().lower() for v in values if v.strip()]
+        # Blank values are ignored rather than matching nothing
+        if values:
+            normalized[key] = values
+
+    date_range = filters.get('last_modified')
+    if date_range:
+        if not isinstance(date_range, dict) or not set(date_range) <= {'from', 'to'}:
+            raise ValueError('last_modified must be {"from": ..., "to": ...}')
+        bounds = {}
+        for bound, value in date_range.items():
+            if value in (None, ''):
+                continue
+            # Bounds are compared as strings against Confluence's ISO-8601 timestamps
+            try:
+                datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+            except (AttributeError, ValueError):
+                raise ValueError(f"last_modified.{bound} must be an ISO-8601 date or timestamp, got {value!r}")
+            bounds[bound] = value.strip()
+        if bounds:
+            normalized['last_modified'] = bounds
+
+    return normalized or None
+
+
+def bitmap_from_filters(filters: Dict, filter_index: Dict) -> int:
+    """Intersect the precomputed per-attribute bitmaps for a set of filters"""
+    doc_count = filter_index['doc_count']
+    allowed = (1 << doc_count) - 1
+    for key, attribute in (('space', 'space'), ('labels', 'label'), ('author', 'author')):
+        if key in filters:
+            bitmaps = filter_index.get(attribute, {})
+            attribute_bits = 0
+            for value in filters[key]:
+                attribute_bits |= bitmaps.get(value, 0)
+            allowed &= attribute_bits
+
+    date_range = filters.get('last_modified')
+    if date_range and allowed:
+        # ISO-8601 strings sort chronologically; the "\uffff" suffix makes a
+        # date-only upper bound such as "2026-09-30" include the whole day
+        values = filter_index['last_modified']['values']
+        doc_ids = filter_index['last_modified']['doc_ids']
+        start = bisect_left(values, date_range['from']) if 'from' in date_range else 0
+        end = bisect_right(values, date_range['to'] + '\uffff') if 'to' in date_range else len(values)
+        # Set bits in a byte buffer and convert once; shifting into an int per doc is quadratic
+        range_bytes = bytearray((doc_count + 7) // 8)
+        for doc_id in doc_ids[start:end]:
+            range_bytes[doc_id >> 3] |= 1 << (doc_id & 7)
+        allowed &= int.from_bytes(range_bytes, 'little')
+
+    return allowed
+
+
+def iter_bitmap(bitmap: int):
+    """Yield the positions of set bits in ascending order, walking the bitmap a byte at a time"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index * 8
+            for bit in BYTE_BITS[byte]:
+                yield base + bit
+
+
+def doc_matches_filters(doc: Dict, filters: Dict) -> bool:
+    """Per-document fallback used when the filter index is missing or stale"""
+    if 'space' in filters and doc.get('space', '').lower() not in filters['space']:
+        return False
+    if 'labels' in filters and not {l.lower() for l in doc.get('labels', [])} & set(filters['labels']):
+        return False
+    if 'author' in filters and doc.get('author', '').lower() not in filters['author']:
+        return False
+    date_range = filters.get('last_modified', {})
+    last_modified = doc.get('last_modified', '')
+    if 'from' in date_range and last_modified < date_range['from']:
+        return False
+    if 'to' in date_range and last_modified > date_range['to'] + '\uffff':
+        return False
+    return True
+
+
+def load_filter_index(doc_count: int, index_etag: str) -> Dict:
+    """
+    confluence-filters.json with its bitmaps parsed, cached per container. The sync
+    stamps it with the ETag of the confluence-index.json it was built from, so a
+    filter index from another publish is never applied to the wrong positions.
+    """
+    if not index_etag:
+        return None
+    if filter_cache['index_etag'] == index_etag and (
+            filter_cache['index'] is not None or time.time() - filter_cache['loaded_at'] < FILTER_RETRY_SECONDS):
+        return filter_cache['index']
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key='confluence-index.json')
-        content_index = json.loads(response['Body'].read().decode('utf-8'))
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key='confluence-filters.json')
+        filter_index = json.loads(response['Body'].read().decode('utf-8'))
+        if filter_index.get('index_etag') != index_etag or filter_index.get('doc_count') != doc_count:
+            logger.warning("Filter index does not match document index, falling back to per-doc filtering")
+            filter_index = None
+        else:
+            for attribute in ('space', 'label', 'author'):
+                filter_index[attribute] = {value: int(bits, 16) for value, bits in filter_index[attribute].items()}
+    except Exception as e:
+        logger.warning(f"Filter index unavailable, falling back to per-doc filtering: {str(e)}")
+        filter_index = None
+    filter_cache.update(index_etag=index_etag, index=filter_index, loaded_at=time.time())
+    return filter_index
+
 
-        query_words = query.lower().split()
-        results = []
+def candidate_doc_ids(content_index: List[Dict], filters: Dict, index_etag: str = None):
+    """Doc positions that pass the filters, resolved before any scoring happens"""
+    if not filters:
+        return range(len(content_index))
+    filter_index = load_filter_index(len(content_index), index_etag)
+    if filter_index is not None:
+        return iter_bitmap(bitmap_from_filters(filters, filter_index))
+    return (i for i, doc in enumerate(content_index) if doc_matches_filters(doc, filters))
 
-        for doc in content_index:
-            title = doc.get('title', '').lower()
-            content = doc.get('content', '').lower()
-            score = sum(3 for word in query_words if word in title) + \
-                    sum(1 for word in query_words if word in content)
 
-            if score > 0:
-                results.append({
-                    'title': doc.get('title', ''),
-                    'content': doc.get('content', ''),
-                    'url': doc.get('url', ''),
-                    'score': score
-                })
+def lexical_score(query_words: List[str], doc: Dict) -> int:
+    """Stage 1 score: 3 per query word found in the title, 1 per word found in the content"""
+    title = doc.get('title', '').lower()
+    content = doc.get('content', '').lower()
+    return sum(3 for word in query_words if word in title) + \
+           sum(1 for word in query_words if word in content)
 
-        results.sort(key=lambda x: x['score'], reverse=True)
-        logger.info(f"Found {len(results)} results from simple search")
-        return results[:5]
 
+def retrieve_candidates(query_words: List[str], content_index: List[Dict], doc_ids, limit: int) -> List[tuple]:
+    """
+    Stage 1: score docs cheaply and keep the top `limit` (score, doc_id) pairs
+    with heap selection. Nothing is copied out of the index here.
+    """
+    scored = ((lexical_score(query_words, content_index[doc_id]), doc_id) for doc_id in doc_ids)
+    return heapq.nlargest(limit, (pair for pair in scored if pair[0] > 0), key=lambda pair: pair[0])
+
+
+def term_proximity(query_words: List[str], content: str) -> float:
+    """
+    1.0 when the matched query words appear next to each other, decaying as the
+    smallest window containing all of them grows (gap measured in ~6-char tokens)
+    """
+    distinct_words = sorted(set(query_words), key=len, reverse=True)
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(word) for word in distinct_words) + r')', re.IGNORECASE)
+    term_ids = {word: i for i, word in enumerate(distinct_words)}
+    positions = [(match.start(), term_ids[match.group(1).lower()]) for match in pattern.finditer(content)]
+    matched_terms = {term_id for _, term_id in positions}
+    if not matched_terms:
+        return 0.0
+    if len(matched_terms) == 1:
+        return 1.0 / len(distinct_words)
+
+    # Sliding window over match offsets for the smallest span covering every matched term
+    best_window = len(content)
+    counts = {}
+    left = 0
+    for position, term_id in positions:
+        counts[term_id] = counts.get(term_id, 0) + 1
+        while len(counts) == len(matched_terms):
+            best_window = min(best_window, position - positions[left][0])
+            left_term = positions[left][1]
+            counts[left_term] -= 1
+            if not counts[left_term]:
+                del counts[left_term]
+            left += 1
+    matched_chars = sum(len(distinct_words[term_id]) + 1 for term_id in matched_terms)
+    gap_tokens = max(0, best_window - matched_chars) / 6
+    return (len(matched_terms) / len(distinct_words)) / (1 + gap_tokens)
+
+
+def freshness(last_modified: str, now: datetime) -> float:
+    """Exponential decay on page age with FRESHNESS_HALF_LIFE_DAYS half-life"""
+    try:
+        modified = datetime.fromisoformat(last_modified.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return 0.0
+    if modified.tzinfo is None:
+        modified = modified.replace(tzinfo=timezone.utc)
+    age_days = max(0.0, (now - modified).total_seconds() / 86400)
+    return 0.5 ** (age_days / FRESHNESS_HALF_LIFE_DAYS)
+
+
+def rerank_candidates(query_words: List[str], content_index: List[Dict], candidates: List[tuple],
+                      top_k: int, weights: Dict = None) -> List[tuple]:
+    """
+    Stage 2: rescore stage-1 candidates with a weighted sum of title match, term
+    proximity, freshness and space priors. Returns (score, doc_id) pairs.
+    """
+    if not candidates:
+        return []
+    weights = weights or RERANK_WEIGHTS
+    now = datetime.now(timezone.utc)
+    distinct_words = set(query_words)
+    max_lexical = candidates[0][0]
+
+    reranked = []
+    for lexical, doc_id in candidates:
+        doc = content_index[doc_id]
+        title = doc.get('title', '').lower()
+        features = {
+            'lexical': lexical / max_lexical,
+            'title': sum(1 for word in distinct_words if word in title) / len(distinct_words),
+            'proximity': term_proximity(query_words, doc.get('content', '')) if weights.get('proximity') else 0.0,
+            'freshness': freshness(doc.get('last_modified', ''), now) if weights.get('freshness') else 0.0,
+            'space': float(SPACE_PRIORS.get(doc.get('space', ''), 0.5))
+        }
+        score = sum(weights.get(name, 0.0) * value for name, value in features.items())
+        reranked.append((score, doc_id))
+    return heapq.nlargest(top_k, reranked, key=lambda pair: pair[0])
+
+
+def load_trigram_index() -> Dict:
+    """confluence-trigrams.json plus a term -> id map, cached per container (a missing index is cached too)"""
+    if trigram_cache['loaded_at'] and time.time() - trigram_cache['loaded_at'] < TRIGRAM_CACHE_SECONDS:
+        return trigram_cache['index']
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key='confluence-trigrams.json')
+        index = json.loads(response['Body'].read().decode('utf-8'))
+        index['term_ids'] = {term: i for i, term in enumerate(index['terms'])}
+        index['lengths'] = [len(term) for term in index['terms']]
     except Exception as e:
-        logger.error(f"Error searching content: {str(e)}")
+        logger.warning(f"Trigram index unavailable, typo expansion disabled: {str(e)}")
+        index = None
+    trigram_cache.update(loaded_at=time.time(), index=index)
+    return index
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance, or limit + 1 as soon as it is known to exceed limit.
+    Only cells within `limit` of the diagonal can stay under the bound, so each
+    row computes that band alone.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= limit else over
+        row_min = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != b[j - 1]), over)
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        previous = current
+    return previous[-1]
+
+
+def expand_term(word: str, index: Dict) -> List[str]:
+    """
+    Close vocabulary matches for a word: within EXPANSION_MAX_DISTANCE edits, or a
+    prefix variant such as onboard/onboarding. Candidates come from the trigram
+    postings, must share enough trigrams and be close enough in length to possibly
+    match, and only the EXPANSION_MAX_CANDIDATES best by shared trigrams are checked.
+    """
+    word_trigrams = character_trigrams(word)
+    shared = Counter()
+    for trigram in word_trigrams:
+        shared.update(index['postings'].get(trigram, ()))
+
+    # Short words tolerate fewer edits
+    max_distance = 1 if len(word) <= 5 else EXPANSION_MAX_DISTANCE
+    # Each edit destroys at most 3 trigrams
+    min_shared = max(1, len(word_trigrams) - 3 * max_distance)
+    max_length_gap = max(max_distance, PREFIX_MAX_EXTRA_CHARS)
+    lengths = index['lengths']
+    candidates = []
+    for term_id, count in shared.most_common():
+        if count < min_shared or len(candidates) >= EXPANSION_MAX_CANDIDATES:
+            break
+        if abs(lengths[term_id] - len(word)) <= max_length_gap:
+            candidates.append(term_id)
+
+    matches = []
+    for term_id in candidates:
+        term = index['terms'][term_id]
+        length_gap = abs(len(term) - len(word))
+        if length_gap > max_distance:
+            # Too far apart for an edit match; only a prefix variant can qualify
+            shorter, longer = sorted((word, term), key=len)
+            if len(shorter) < 4 or not longer.startswith(shorter):
+                continue
+            distance = length_gap
+        else:
+            distance = bounded_edit_distance(word, term, max_distance)
+            if distance > max_distance:
+                continue
+        matches.append((distance, -index['df'][term_id], term))
+    matches.sort()
+    return [term for _, _, term in matches[:EXPANSION_MAX_TERMS]]
+
+
+def expand_query_words(query_words: List[str]) -> List[str]:
+    """Add close vocabulary spellings for query words the corpus does not contain"""
+    index = load_trigram_index()
+    if index is None:
+        return query_words
+    expanded = list(query_words)
+    for word in query_words:
+        term = re.sub(r'[^a-z0-9]', '', word)
+        if len(term) < 4 or term in STOPWORDS or term.isdigit() or term in index['term_ids']:
+            continue
+        expansions = [t for t in expand_term(term, index) if t not in expanded]
+        if expansions:
+            logger.info(f"Expanded '{word}' to {expansions}")
+            expanded.extend(expansions)
+    return expanded
+
+
+def rank_documents(query: str, content_index: List[Dict], filters: Dict = None,
+                   candidates: int = None, top_k: int = None, weights: Dict = None,
+                   timings: Dict = None, index_etag: str = None) -> List[tuple]:
+    """
+    Run both retrieval stages and return the final (score, doc_id) pairs.
+    Per-stage milliseconds are added to `timings` when given; `index_etag`
+    identifies content_index so the matching filter index can be used.
+    """
+    timings = timings if timings is not None else {}
+    query_words = query.lower().split()
+    if not query_words:
         return []
 
+    started = time.perf_counter()
+    if TYPO_EXPANSION:
+        query_words = expand_query_words(query_words)
+    timings['expansion'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    doc_ids = candidate_doc_ids(content_index, filters, index_etag)
+    stage_one = retrieve_candidates(query_words, content_index, doc_ids, candidates or RETRIEVAL_CANDIDATES)
+    timings['stage_one'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    ranked = rerank_candidates(query_words, content_index, stage_one, top_k or RETRIEVAL_TOP_K, weights)
+    timings['rerank'] = (time.perf_counter() - started) * 1000
+    return ranked
+
 
-def generate_ai_response(query: str, search_results: List[Dict]) -> str:
+def search_confluence_content(query: str, filters: Dict = None, timings: Dict = None) -> List[Dict]:
+    timings = timings if timings is not None else {}
     try:
-        context = ""
-        for i, result in enumerate(search_results, 1):
-            title = result.get('title', 'Unknown Document')
-            content = result.get('content', '')[:1000]
-            context += f"\n\nDocument {i}: {title}\n{content}"
+        started = time.perf_counter()
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key='confluence-index.json')
+        content_index = json.loads(response['Body'].read().decode('utf-8'))
+        timings['index_load'] = (time.perf_counter() - started) * 1000
+
+        ranked = rank_documents(query, content_index, filters, timings=timings, index_etag=response.get('ETag'))
+        results = [
+            {
+                'title': content_index[doc_id].get('title', ''),
+                'content': content_index[doc_id].get('content', ''),
+                'url': content_index[doc_id].get('url', ''),
+                'score': round(score, 4),
+                'summary': content_index[doc_id].get('summary'),
+                'key_facts': content_index[doc_id].get('key_facts', [])
+            }
+            for score, doc_id in ranked
+        ]
+        logger.info(f"Returning {len(results)} results from two-stage search")
+        return results
+
+    except Exception as e:
+        logger.error(f"Error searching content: {str(e)}")
+        return []
+
 
-        prompt = f"""Based on the following Confluence documentation, please answer the user's question. 
-If the information isn't available in the provided context, please say so.
+def keywords(text: str) -> List[str]:
+    """Lower-cased query words without stopwords or punctuation"""
+    words = re.findall(r'[a-z0-9][a-z0-9_.-]*', text.lower())
+    return [word.strip('.-') for word in words if word not in STOPWORDS]
 
-Context from Confluence:{context}
 
-User Question: {query}
+def is_follow_up(query: str, history: List[Dict]) -> bool:
+    """
+    A question leans on earlier turns only when it says so: it opens with a
+    continuation ("and for staging?", "what about prod?"), has no keywords of
+    its own, or refers back with a pronoun and barely any content words
+    ("how do I roll it back?"). Short questions on a new subject are standalone.
+    """
+    if not history:
+        return False
+    query_keywords = keywords(query)
+    return not query_keywords or bool(CONTINUATION_PATTERN.search(query)) or \
+        (bool(REFERENCE_PATTERN.search(query)) and len(query_keywords) <= REFERENCE_MAX_KEYWORDS)
 
-Please provide a helpful and accurate answer based on the context above:"""
 
+def turn_topic(query: str, history: List[Dict]) -> List[str]:
+    """
+    Keywords follow-ups to this turn should carry: the turn's own keywords when it
+    is standalone, otherwise the topic of the turn it followed up on. Capped at
+    SESSION_MAX_CARRIED_TERMS so a conversation cannot keep accumulating terms.
+    """
+    if not is_follow_up(query, history):
+        return keywords(query)[:SESSION_MAX_CARRIED_TERMS]
+    previous = history[-1]
+    if 'topic' in previous:
+        return previous['topic']
+    return keywords(previous.get('search_query', ''))[:SESSION_MAX_CARRIED_TERMS]
+
+
+def rewrite_query(query: str, history: List[Dict]) -> str:
+    """
+    Turn a follow-up such as "and for staging?" into a standalone search query by
+    adding the keywords of the last standalone question. Earlier follow-ups are
+    not carried, so "what about prod?" after "and for staging?" drops staging.
+    Queries that do not look like follow-ups are searched as-is.
+    """
+    if not is_follow_up(query, history):
+        return query
+    new_keywords = keywords(query)
+    carried = [word for word in turn_topic(query, history) if word not in new_keywords]
+    return ' '.join(new_keywords + carried)
+
+
+def passages_cover(query: str, session: Dict, filters: Dict) -> bool:
+    """
+    True when the query is a follow-up and the session's last passages contain
+    enough of the keywords it adds to the carried topic. Standalone questions
+    always retrieve, however many of their words the old passages happen to share.
+    """
+    history = session['turns']
+    if not session['passages'] or filters != session.get('filters') or not is_follow_up(query, history):
+        return False
+    topic = set(turn_topic(query, history))
+    new_keywords = set(keywords(query)) - topic
+    if not new_keywords:
+        return True
+    text = ' '.join(f"{p.get('title', '')} {p.get('content', '')}" for p in session['passages']).lower()
+    covered = sum(1 for word in new_keywords if word in text)
+    return covered / len(new_keywords) >= SESSION_REUSE_COVERAGE
+
+
+def choose_context_mode(query: str) -> str:
+    """
+    'summary' for broad questions, where a page summary carries the answer with far
+    fewer tokens, and 'raw' for detail questions that need exact wording.
+    Ambiguous questions get raw passages.
+    """
+    if PROMPT_CONTEXT_MODE in ('summary', 'raw'):
+        return PROMPT_CONTEXT_MODE
+    if DETAIL_QUESTION_PATTERN.search(query):
+        return 'raw'
+    if BROAD_QUESTION_PATTERN.search(query):
+        return 'summary'
+    return 'raw'
+
+
+def passage_text(result: Dict, context_mode: str) -> str:
+    """Prompt text for one search result: its summary and key facts, or the raw passage"""
+    if context_mode == 'summary' and result.get('summary'):
+        facts = ''.join(f"\n- {fact}" for fact in result.get('key_facts', []))
+        return f"Summary: {result['summary']}{facts}"
+    return result.get('content', '')[:PROMPT_PASSAGE_CHARS]
+
+
+def build_messages(query: str, search_results: List[Dict], history: List[Dict], context_mode: str = 'raw') -> Dict:
+    """
+    Lay the prompt out as static system text, then the retrieved context, then
+    prior turns, then the new question. Follow-ups that reuse passages share the
+    whole prefix up to the new question, which is what prompt caching keys on.
+    """
+    context = ""
+    for i, result in enumerate(search_results, 1):
+        title = result.get('title', 'Unknown Document')
+        content = passage_text(result, context_mode)
+        context += f"\n\nDocument {i}: {title}\n{content}"
+
+    context_block = {"type": "text", "text": f"Context from Confluence:{context}"}
+    system_block = {"type": "text", "text": SYSTEM_PROMPT}
+    if BEDROCK_PROMPT_CACHE:
+        system_block["cache_control"] = {"type": "ephemeral"}
+        context_block["cache_control"] = {"type": "ephemeral"}
+
+    def question_block(text):
+        return {"type": "text", "text": f"User Question: {text}\n\nPlease provide a helpful and accurate answer based on the context above:"}
+
+    turns = [(turn['query'], turn['answer']) for turn in history] + [(query, None)]
+    messages = []
+    for i, (turn_query, turn_answer) in enumerate(turns):
+        content = [context_block, question_block(turn_query)] if i == 0 else [question_block(turn_query)]
+        messages.append({"role": "user", "content": content})
+        if turn_answer is not None:
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": turn_answer}]})
+
+    return {"system": [system_block], "messages": messages}
+
+
+def generate_ai_response(query: str, search_results: List[Dict], history: List[Dict] = None,
+                         context_mode: str = 'raw') -> tuple:
+    """Return (answer, usage); usage carries Bedrock's token counts when available"""
+    try:
         request_body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": 1000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
+            **build_messages(query, search_results, history or [], context_mode)
         }
 
         response = bedrock_client.invoke_model(
@@ -183,13 +783,14 @@ Please provide a helpful and accurate answer based on the context above:"""
 
         response_body = json.loads(response['body'].read())
         ai_answer = response_body.get('content', [{}])[0].get('text', 'No response generated')
+        usage = response_body.get('usage', {})
 
-        logger.info("Generated AI response successfully")
-        return ai_answer
+        logger.info(f"Generated AI response successfully (usage: {usage})")
+        return ai_answer, usage
 
     except Exception as e:
         logger.error(f"Error generating AI response: {str(e)}")
-        return f"I found some relevant information in your Confluence docs, but couldn't generate a proper response. Error: {str(e)}"
+        return f"I found some relevant information in your Confluence docs, but couldn't generate a proper response. Error: {str(e)}", {}
 
 
 def make_confluence_request(url: str, auth_header: str) -> dict:
@@ -7,6 +7,9 @@ import urllib3
 from datetime import datetime
 import logging
 
+from confluence_extraction import ProcessStage, StageError
+from confluence_profiler import profile_handler
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,6 +18,7 @@ logger.setLevel(logging.INFO)
 s3_client = boto3.client('s3')
 http = urllib3.PoolManager()
 
+@profile_handler("confluence-daily-digest")
 def lambda_handler(event, context):
     """
     Lambda function to send daily "Did you know?" messages from Confluence to Slack
@@ -92,24 +96,29 @@ def extract_interesting_snippets(confluence_data):
     """Extract interesting snippets from Confluence content"""
     snippets = []
     
-    for item in confluence_data:
-        content = item.get('content', '')
-        title = item.get('title', '')
-        url = item.get('url', '')
-        space = item.get('space', '')
-        
-        # Skip if content is too short
-        if len(content) < 100:
+    # Skip if content is too short
+    items = [item for item in confluence_data if len(item.get('content', '')) >= 100]
+    
+    # Snippet scoring is CPU-bound, so it runs on the extraction process pool
+    scored_pages = snippet_stage.map([item.get('content', '') for item in items])
+    for scored_snippets, item in zip(scored_pages, items):
+        if isinstance(scored_snippets, StageError):
+            logger.error(f"Snippet scoring failed for {item.get('title', 'unknown')}: {str(scored_snippets)}")
             continue
-        
-        # Extract interesting sentences/paragraphs
-        interesting_parts = find_interesting_content(content, title, url, space)
-        snippets.extend(interesting_parts)
+        for snippet in scored_snippets:
+            snippet.update({
+                'title': item.get('title', ''),
+                'url': item.get('url', ''),
+                'space': item.get('space', '')
+            })
+            snippets.append(snippet)
     
+    logger.info(f"Snippet scoring: {json.dumps(snippet_stage.report())}")
+    snippet_stage.reset_stats()
     return snippets
 
-def find_interesting_content(content, title, url, space):
-    """Find interesting content patterns within a page"""
+def score_content_snippets(content):
+    """Score candidate snippets in a page's text; runs on the extraction workers"""
     snippets = []
     
     # Split content into sentences
@@ -157,9 +166,6 @@ def find_interesting_content(content, title, url, space):
             if len(context) > 50:
                 snippets.append({
                     'content': context,
-                    'title': title,
-                    'url': url,
-                    'space': space,
                     'score': score,
                     'type': classify_content_type(context)
                 })
@@ -298,6 +304,9 @@ def send_to_slack(webhook_url, message):
         logger.error(f"Error sending to Slack: {str(e)}")
         raise
 
+# Snippet scoring stage, sized to the available vCPUs
+snippet_stage = ProcessStage(score_content_snippets)
+
 # Additional utility function for testing
 def test_handler(event, context):
     """Test function to preview messages without sending to Slack"""
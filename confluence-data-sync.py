@@ -7,13 +7,25 @@ import base64
 import logging
 import re
 import os
+import hashlib
+import argparse
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from confluence_attachments import attachment_text, list_attachments
+from confluence_extraction import EXTRACTION_WORKERS, ProcessStage, StageError, available_cpus, character_trigrams, tokenize
+from confluence_local import bedrock_client_from_env, s3_client_from_env
+from confluence_profiler import profile_handler
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-s3_client = boto3.client('s3')
+# Initialize AWS clients (LOCAL_STAND_IN_DIR swaps S3 for a local directory)
+s3_client = s3_client_from_env()
 
 # Configuration - all from environment variables
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
@@ -21,6 +33,39 @@ CONFLUENCE_BASE_URL = os.getenv("CONFLUENCE_BASE_URL")
 CONFLUENCE_USERNAME = os.getenv("CONFLUENCE_USERNAME")
 CONFLUENCE_API_TOKEN = os.getenv("CONFLUENCE_API_TOKEN")
 
+# Sync scope and fan-out configuration
+SYNC_MAX_SPACES = int(os.getenv("SYNC_MAX_SPACES", "3"))
+SYNC_MAX_PAGES_PER_SPACE = int(os.getenv("SYNC_MAX_PAGES_PER_SPACE", "25"))
+SYNC_PARTITION_SIZE = int(os.getenv("SYNC_PARTITION_SIZE", "25"))
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "25"))
+# Name of the Lambda that workers run in; when unset the coordinator runs partitions itself
+SYNC_WORKER_FUNCTION = os.getenv("SYNC_WORKER_FUNCTION")
+# lambda = async invoke per partition, process = local process pool, inline = sequential in this invocation
+SYNC_FANOUT = os.getenv("SYNC_FANOUT", "lambda" if SYNC_WORKER_FUNCTION else "inline")
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", str(os.cpu_count() or 2)))
+# Stop taking new batches when less than this much Lambda time is left
+SYNC_TIME_RESERVE_MS = int(os.getenv("SYNC_TIME_RESERVE_MS", "60000"))
+# A partition whose checkpoint heartbeat is younger than this is held by a live worker
+SYNC_LEASE_SECONDS = int(os.getenv("SYNC_LEASE_SECONDS", "600"))
+SYNC_RUN_PREFIX = 'sync-runs/'
+PAGE_EXPAND = 'body.storage,version,history,metadata.labels'
+
+# Optional per-page summaries, regenerated only when a page's content hash changes
+SYNC_SUMMARIES = os.getenv("SYNC_SUMMARIES", "false").lower() in ("1", "true", "yes")
+SUMMARY_MODEL_ID = os.getenv("SUMMARY_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "5"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_INPUT_CHARS = int(os.getenv("SUMMARY_INPUT_CHARS", "6000"))
+# Cap on new summaries per run; the rest are picked up by later runs
+SUMMARY_MAX_PER_RUN = int(os.getenv("SUMMARY_MAX_PER_RUN", "200"))
+SUMMARY_CACHE_KEY = 'confluence-summaries.json'
+
+# Optional attachment indexing; extracted text is cached per attachment version
+SYNC_ATTACHMENTS = os.getenv("SYNC_ATTACHMENTS", "false").lower() in ("1", "true", "yes")
+ATTACHMENT_CONCURRENCY = int(os.getenv("ATTACHMENT_CONCURRENCY", "4"))
+
+bedrock_client = None
+
 def create_auth_header(username, api_token):
     """Create Basic Auth header"""
     credentials = f"{username}:{api_token}"
@@ -78,6 +123,224 @@ def make_request(url, auth_header, params=None):
             'error': str(e)
         }
 
+def page_html(page):
+    """Storage-format HTML body of a page"""
+    return page.get('body', {}).get('storage', {}).get('value', '')
+
+def build_document(page, space_key, extracted=None):
+    """
+    Build an index document from a Confluence page, or None if it has no body.
+    `extracted` is the extraction stage output for the page; 'terms' stays on
+    the document until publish_index folds it into the vocabulary.
+    """
+    html_content = page_html(page)
+    
+    if not html_content:
+        logger.warning(f"No content found for page: {page.get('title', 'Unknown')}")
+        return None
+    
+    extracted = extracted or extract_page(html_content)
+    
+    return {
+        'id': page['id'],
+        'title': page['title'],
+        'content': extracted['content'],
+        'terms': extracted['terms'],
+        'url': f"{CONFLUENCE_BASE_URL}/wiki{page['_links']['webui']}",
+        'space': space_key,
+        'last_modified': page['version']['when'],
+        'labels': extract_labels(page),
+        'author': extract_author(page)
+    }
+
+def build_attachment_documents(page_doc, auth_header):
+    """
+    One index document per attachment with extractable text. Attachments are
+    read through the version-keyed cache, so unchanged files are never
+    downloaded or parsed again.
+    """
+    attachments = list_attachments(CONFLUENCE_BASE_URL, page_doc['id'], make_request, auth_header)
+    if not attachments:
+        return []
+
+    def extract(attachment):
+        return attachment_text(attachment, CONFLUENCE_BASE_URL, auth_header, s3_client, S3_BUCKET)
+
+    with ThreadPoolExecutor(max_workers=ATTACHMENT_CONCURRENCY) as pool:
+        entries = list(pool.map(extract, attachments))
+
+    docs = []
+    for attachment, entry in zip(attachments, entries):
+        if not entry['text']:
+            if entry.get('skipped'):
+                logger.info(f"Skipped attachment {attachment.get('title')}: {entry['skipped']}")
+            continue
+        links = attachment.get('_links', {})
+        docs.append({
+            'id': f"{page_doc['id']}-attachment-{attachment['id']}",
+            'title': f"{page_doc['title']} / {attachment.get('title', 'attachment')}",
+            'content': entry['text'],
+            'terms': sorted(set(tokenize(entry['text']))),
+            'url': f"{CONFLUENCE_BASE_URL}/wiki{links.get('webui') or links.get('download', '')}",
+            'space': page_doc['space'],
+            'last_modified': attachment.get('version', {}).get('when') or page_doc['last_modified'],
+            'labels': page_doc['labels'],
+            'author': page_doc['author'],
+            'page_id': page_doc['id']
+        })
+    logger.info(f"Indexed {len(docs)} of {len(attachments)} attachments on page {page_doc['title']}")
+    return docs
+
+def publish_index(confluence_docs):
+    """Write the document index, its filter index and the term vocabulary to S3"""
+    vocabulary = Counter()
+    for doc in confluence_docs:
+        vocabulary.update(doc.pop('terms', []))
+
+    if SYNC_SUMMARIES:
+        try:
+            attach_summaries(confluence_docs)
+        except Exception as e:
+            # Summaries are an optimization; publish without them rather than fail the sync
+            logger.error(f"Summary stage failed: {str(e)}")
+
+    response = s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key='confluence-index.json',
+        Body=json.dumps(confluence_docs, indent=2),
+        ContentType='application/json'
+    )
+    logger.info(f"Successfully saved {len(confluence_docs)} documents to S3")
+
+    # Filter index is keyed by position in confluence-index.json, so write it after the docs
+    # and stamp it with their ETag; the query side ignores it for any other index version
+    filter_index = build_filter_index(confluence_docs)
+    filter_index['index_etag'] = response.get('ETag')
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key='confluence-filters.json',
+        Body=json.dumps(filter_index),
+        ContentType='application/json'
+    )
+    logger.info(f"Saved filter index: {len(filter_index['space'])} spaces, "
+                f"{len(filter_index['label'])} labels, {len(filter_index['author'])} authors")
+
+    # Document frequency per term
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key='confluence-vocabulary.json',
+        Body=json.dumps(dict(vocabulary)),
+        ContentType='application/json'
+    )
+    logger.info(f"Saved vocabulary: {len(vocabulary)} terms")
+
+    trigram_index = build_trigram_index(vocabulary)
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key='confluence-trigrams.json',
+        Body=json.dumps(trigram_index, separators=(',', ':')),
+        ContentType='application/json'
+    )
+    logger.info(f"Saved trigram index: {len(trigram_index['terms'])} terms, "
+                f"{len(trigram_index['postings'])} trigrams")
+
+def build_trigram_index(vocabulary):
+    """
+    Character-trigram postings over the term vocabulary, used by the query to
+    find close spellings without scanning the vocabulary. Terms are stored
+    sorted with their document frequency; postings hold term positions.
+    Numbers, very short and very long terms are left out.
+    """
+    terms = sorted(term for term in vocabulary if 3 <= len(term) <= 30 and not term.isdigit())
+    postings = {}
+    for term_id, term in enumerate(terms):
+        for trigram in character_trigrams(term):
+            postings.setdefault(trigram, []).append(term_id)
+    return {
+        'version': 1,
+        'terms': terms,
+        'df': [vocabulary[term] for term in terms],
+        'postings': postings
+    }
+
+def content_hash(doc):
+    """Hash of the text a summary is generated from"""
+    return hashlib.sha256(f"{doc['title']}\n{doc['content']}".encode('utf-8')).hexdigest()
+
+def summarize_batch(docs):
+    """Summarize a batch of pages in one Bedrock call; returns {page_id: {summary, key_facts}}"""
+    pages = "\n\n".join(
+        f'<page id="{doc["id"]}" title="{doc["title"]}">{doc["content"][:SUMMARY_INPUT_CHARS]}</page>'
+        for doc in docs
+    )
+    prompt = f"""Summarize each Confluence page below so it can stand in for the page when answering broad questions.
+Respond with only a JSON object mapping each page id to {{"summary": "<2-3 sentences>", "key_facts": ["<short fact>", ...]}} with at most 5 key facts per page.
+
+{pages}"""
+
+    request_body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 300 * len(docs),
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    try:
+        response = bedrock_client.invoke_model(
+            modelId=SUMMARY_MODEL_ID,
+            body=json.dumps(request_body),
+            contentType='application/json'
+        )
+        text = json.loads(response['body'].read()).get('content', [{}])[0].get('text', '')
+        parsed = json.loads(text[text.index('{'):text.rindex('}') + 1])
+        return {
+            str(page_id): {
+                'summary': str(value.get('summary', '')).strip(),
+                'key_facts': [str(fact).strip() for fact in value.get('key_facts', [])][:5]
+            }
+            for page_id, value in parsed.items() if isinstance(value, dict)
+        }
+    except Exception as e:
+        logger.error(f"Failed to summarize batch {[doc['id'] for doc in docs]}: {str(e)}")
+        return {}
+
+def attach_summaries(confluence_docs):
+    """
+    Add 'summary' and 'key_facts' to documents. Summaries are cached in
+    confluence-summaries.json by page id and content hash, so only new or
+    changed pages go to Bedrock, in batches run concurrently.
+    """
+    global bedrock_client
+    if bedrock_client is None:
+        bedrock_client = bedrock_client_from_env()
+
+    cache = get_json(SUMMARY_CACHE_KEY, {})
+    hashes = {doc['id']: content_hash(doc) for doc in confluence_docs}
+    stale = [doc for doc in confluence_docs if cache.get(doc['id'], {}).get('hash') != hashes[doc['id']]]
+    to_generate = stale[:SUMMARY_MAX_PER_RUN]
+    logger.info(f"Summaries: {len(confluence_docs) - len(stale)} cached, {len(to_generate)} to generate, "
+                f"{len(stale) - len(to_generate)} deferred")
+
+    batches = [to_generate[i:i + SUMMARY_BATCH_SIZE] for i in range(0, len(to_generate), SUMMARY_BATCH_SIZE)]
+    generated_at = datetime.now(timezone.utc).isoformat()
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        for summaries in pool.map(summarize_batch, batches):
+            for page_id, summary in summaries.items():
+                if page_id in hashes:
+                    cache[page_id] = {**summary, 'hash': hashes[page_id], 'generated_at': generated_at}
+
+    # Drop pages that no longer exist
+    cache = {page_id: entry for page_id, entry in cache.items() if page_id in hashes}
+    put_json(SUMMARY_CACHE_KEY, cache)
+
+    attached = 0
+    for doc in confluence_docs:
+        entry = cache.get(doc['id'])
+        if entry and entry['hash'] == hashes[doc['id']] and entry['summary']:
+            doc['summary'] = entry['summary']
+            doc['key_facts'] = entry['key_facts']
+            attached += 1
+    logger.info(f"Attached summaries to {attached} of {len(confluence_docs)} documents")
+
+@profile_handler("confluence-data-sync")
 def lambda_handler(event, context):
     """
     Sync Confluence content to S3 with enhanced debugging
@@ -105,6 +368,11 @@ def lambda_handler(event, context):
             })
         }
     
+    extraction_stage.reset_stats()
+    mode = (event or {}).get('mode', 'single')
+    if mode != 'single':
+        return run_distributed_sync(mode, event, context)
+    
     logger.info(f"S3_BUCKET: {S3_BUCKET}")
     logger.info(f"CONFLUENCE_BASE_URL: {CONFLUENCE_BASE_URL}")
     logger.info(f"CONFLUENCE_USERNAME: {CONFLUENCE_USERNAME}")
@@ -164,9 +432,11 @@ def lambda_handler(event, context):
                 })
             }
         
-        # Process each space (limit to first 3 for PoC)
+        # Fetch pages for each space (limited by SYNC_MAX_SPACES), then extract them all
+        # in one stream so the extraction workers see every page, not one space at a time
+        space_pages = []
         spaces_processed = 0
-        for space in spaces[:3]:  # Limit for PoC
+        for space in spaces[:SYNC_MAX_SPACES]:
             space_key = space['key']
             space_name = space.get('name', 'Unknown')
             logger.info(f"Processing space: {space_key} ({space_name})")
@@ -175,8 +445,8 @@ def lambda_handler(event, context):
             pages_url = f"{CONFLUENCE_BASE_URL}/wiki/rest/api/content"
             params = {
                 'spaceKey': space_key,
-                'expand': 'body.storage,version',
-                'limit': 25  # Limit pages per space for PoC
+                'expand': PAGE_EXPAND,
+                'limit': SYNC_MAX_PAGES_PER_SPACE
             }
             
             pages_response = make_request(pages_url, auth_header, params)
@@ -187,43 +457,36 @@ def lambda_handler(event, context):
             pages_data = pages_response['data']
             pages = pages_data.get('results', [])
             logger.info(f"Found {len(pages)} pages in space {space_key}")
-            
-            pages_processed = 0
-            for page in pages:
-                try:
-                    # Extract and clean content
-                    page_body = page.get('body', {})
-                    storage = page_body.get('storage', {})
-                    html_content = storage.get('value', '')
-                    
-                    if not html_content:
-                        logger.warning(f"No content found for page: {page.get('title', 'Unknown')}")
-                        continue
-                    
-                    clean_content = extract_text_from_html(html_content)
-                    
-                    # Build document
-                    doc = {
-                        'id': page['id'],
-                        'title': page['title'],
-                        'content': clean_content,
-                        'url': f"{CONFLUENCE_BASE_URL}/wiki{page['_links']['webui']}",
-                        'space': space_key,
-                        'last_modified': page['version']['when']
-                    }
-                    
-                    confluence_docs.append(doc)
-                    pages_processed += 1
-                    logger.info(f"Processed page {pages_processed}: {page['title']}")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing page {page.get('title', 'unknown')}: {str(e)}")
-                    continue
-            
-            logger.info(f"Completed space {space_key}: {pages_processed} pages processed")
+            space_pages.extend((space_key, page) for page in pages)
             spaces_processed += 1
         
+        pages_processed = Counter()
+        extracted_pages = extraction_stage.map([page_html(page) for _, page in space_pages])
+        # The stage goes first in zip so it runs to completion and records its timing
+        for extracted, (space_key, page) in zip(extracted_pages, space_pages):
+            try:
+                if isinstance(extracted, StageError):
+                    raise extracted
+                doc = build_document(page, space_key, extracted)
+                if doc is None:
+                    continue
+                
+                confluence_docs.append(doc)
+                if SYNC_ATTACHMENTS:
+                    confluence_docs.extend(build_attachment_documents(doc, auth_header))
+                pages_processed[space_key] += 1
+                logger.info(f"Processed page {pages_processed[space_key]}: {page['title']}")
+                
+            except Exception as e:
+                logger.error(f"Error processing page {page.get('title', 'unknown')}: {str(e)}")
+                continue
+        
+        for space_key, count in pages_processed.items():
+            logger.info(f"Completed space {space_key}: {count} pages processed")
+        
         logger.info(f"Total documents collected: {len(confluence_docs)}")
+        extraction_report = extraction_stage.report()
+        logger.info(f"Extraction stage: {json.dumps(extraction_report)}")
         
         if not confluence_docs:
             logger.warning("No documents were collected")
@@ -252,13 +515,7 @@ def lambda_handler(event, context):
         # Save to S3
         logger.info("Saving documents to S3...")
         try:
-            s3_client.put_object(
-                Bucket=S3_BUCKET,
-                Key='confluence-index.json',
-                Body=json.dumps(confluence_docs, indent=2),
-                ContentType='application/json'
-            )
-            logger.info(f"Successfully saved {len(confluence_docs)} documents to S3")
+            publish_index(confluence_docs)
         except Exception as e:
             logger.error(f"Failed to save to S3: {str(e)}")
             return {
@@ -274,7 +531,8 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'message': f'Successfully synced {len(confluence_docs)} documents',
                 'documents': len(confluence_docs),
-                'spaces_processed': spaces_processed
+                'spaces_processed': spaces_processed,
+                'extraction': extraction_report
             })
         }
         
@@ -307,4 +565,467 @@ def extract_text_from_html(html_content: str) -> str:
         return text
     except Exception as e:
         logger.error(f"Error extracting text from HTML: {str(e)}")
-        return html_content  # Return original if extraction fails
\ No newline at end of file
+        return html_content  # Return original if extraction fails
+
+def extract_page(html_content: str) -> dict:
+    """
+    Extraction stage task: clean text plus its distinct terms. Runs on the
+    extraction worker processes, so it must only depend on its argument.
+    """
+    content = extract_text_from_html(html_content)
+    return {'content': content, 'terms': sorted(set(tokenize(content)))}
+
+# CPU-bound extraction runs on a process pool sized to the available vCPUs
+extraction_stage = ProcessStage(extract_page)
+
+def extract_labels(page: dict) -> list:
+    """
+    Extract label names from a page expanded with metadata.labels
+    """
+    labels = page.get('metadata', {}).get('labels', {}).get('results', [])
+    return sorted({label['name'] for label in labels if label.get('name')})
+
+def extract_author(page: dict) -> str:
+    """
+    Extract the page creator, falling back to the last editor
+    """
+    created_by = page.get('history', {}).get('createdBy', {})
+    last_editor = page.get('version', {}).get('by', {})
+    return created_by.get('displayName') or last_editor.get('displayName') or ''
+
+def build_filter_index(docs: list) -> dict:
+    """
+    Build per-attribute bitmaps over document positions in confluence-index.json.
+    Bitmaps are Python ints (bit i set = doc i matches) serialized as hex strings;
+    last_modified is kept as a sorted value array plus matching doc ids for range lookups.
+    """
+    bitmaps = {'space': {}, 'label': {}, 'author': {}}
+    for doc_id, doc in enumerate(docs):
+        bit = 1 << doc_id
+        values = {
+            'space': [doc.get('space', '')],
+            'label': doc.get('labels', []),
+            'author': [doc.get('author', '')]
+        }
+        for attribute, attribute_values in values.items():
+            for value in attribute_values:
+                if value:
+                    key = value.lower()
+                    bitmaps[attribute][key] = bitmaps[attribute].get(key, 0) | bit
+
+    by_date = sorted(range(len(docs)), key=lambda i: docs[i].get('last_modified', ''))
+    return {
+        'version': 1,
+        'doc_count': len(docs),
+        **{
+            attribute: {value: format(bitmap, 'x') for value, bitmap in values.items()}
+            for attribute, values in bitmaps.items()
+        },
+        'last_modified': {
+            'values': [docs[i].get('last_modified', '') for i in by_date],
+            'doc_ids': by_date
+        }
+    }
+
+def run_key(run_id: str, *parts) -> str:
+    """S3 key for an object belonging to a distributed sync run"""
+    return f"{SYNC_RUN_PREFIX}{run_id}/" + '/'.join(parts)
+
+def get_json(key: str, default=None):
+    """Read a JSON object from S3, returning default when it does not exist"""
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except Exception:
+        return default
+
+def put_json(key: str, data):
+    """Write a JSON object to S3"""
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Body=json.dumps(data),
+        ContentType='application/json'
+    )
+
+def out_of_time(context) -> bool:
+    """True when a Lambda invocation is too close to its timeout to start another batch"""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return False
+    return context.get_remaining_time_in_millis() < SYNC_TIME_RESERVE_MS
+
+def run_distributed_sync(mode: str, event: dict, context):
+    """
+    Coordinator/worker/reduce entry point.
+      coordinator - plan (or reload) partitions for run_id and dispatch unfinished ones
+      worker      - process one partition, checkpointing after every batch
+      reduce      - merge finished shards and publish confluence-index.json
+    """
+    try:
+        if mode == 'coordinator':
+            return coordinate_sync(event.get('run_id'), context)
+        if mode == 'worker':
+            return run_worker(event, context)
+        if mode == 'reduce':
+            return reduce_sync(event['run_id'])
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f'Unknown sync mode: {mode}'})
+        }
+    except Exception as e:
+        logger.error(f"Distributed sync ({mode}) failed: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': f'Distributed sync ({mode}) failed: {str(e)}',
+                'run_id': event.get('run_id'),
+                'error_type': type(e).__name__
+            })
+        }
+
+def space_page_count(space_key: str, auth_header: str):
+    """Number of pages in a space from a CQL search, or None when Confluence does not report it"""
+    search_url = f"{CONFLUENCE_BASE_URL}/wiki/rest/api/search"
+    response = make_request(search_url, auth_header, {'cql': f'space="{space_key}" and type=page', 'limit': 1})
+    if response['status_code'] != 200:
+        logger.warning(f"Could not count pages in {space_key}: {response['status_code']}")
+        return None
+    total = response['data'].get('totalSize', response['data'].get('size'))
+    return total if isinstance(total, int) else None
+
+def plan_partitions(auth_header: str) -> list:
+    """
+    Split the sync into (space, page range) partitions sized from each space's
+    page count, so a high SYNC_MAX_PAGES_PER_SPACE does not plan empty ranges
+    """
+    spaces_url = f"{CONFLUENCE_BASE_URL}/wiki/rest/api/space"
+    spaces_response = make_request(spaces_url, auth_header)
+    if spaces_response['status_code'] != 200:
+        raise RuntimeError(f"Failed to get spaces: {spaces_response['status_code']}")
+
+    partitions = []
+    for space in spaces_response['data'].get('results', [])[:SYNC_MAX_SPACES]:
+        page_count = space_page_count(space['key'], auth_header)
+        # Unknown counts fall back to the configured cap
+        space_limit = SYNC_MAX_PAGES_PER_SPACE if page_count is None else min(page_count, SYNC_MAX_PAGES_PER_SPACE)
+        logger.info(f"Space {space['key']}: {page_count} pages, planning {space_limit}")
+        for start in range(0, space_limit, SYNC_PARTITION_SIZE):
+            partitions.append({
+                'id': f"{space['key']}-{start:06d}",
+                'space': space['key'],
+                'start': start,
+                'limit': min(SYNC_PARTITION_SIZE, space_limit - start)
+            })
+    return partitions
+
+def pending_partitions(run_id: str, manifest: dict) -> list:
+    """Partitions whose checkpoint is missing or not yet done"""
+    return [
+        partition for partition in manifest['partitions']
+        if get_json(run_key(run_id, 'checkpoints', f"{partition['id']}.json"), {}).get('status') != 'done'
+    ]
+
+def new_checkpoint(partition: dict) -> dict:
+    return {
+        'partition': partition['id'],
+        'status': 'pending',
+        'next_start': partition['start'],
+        'documents': 0
+    }
+
+def lease_is_fresh(checkpoint: dict) -> bool:
+    """True while a worker holding the partition has written a heartbeat within SYNC_LEASE_SECONDS"""
+    return checkpoint.get('status') == 'in_progress' and \
+        time.time() - checkpoint.get('heartbeat_at', 0) < SYNC_LEASE_SECONDS
+
+def unleased_partitions(run_id: str, partitions: list) -> list:
+    """Pending partitions that no live worker currently holds"""
+    return [
+        partition for partition in partitions
+        if not lease_is_fresh(get_json(run_key(run_id, 'checkpoints', f"{partition['id']}.json"), {}))
+    ]
+
+def acquire_lease(run_id: str, partition: dict) -> str:
+    """Mark a partition in progress under a new lease owner before handing it to a worker"""
+    checkpoint_key = run_key(run_id, 'checkpoints', f"{partition['id']}.json")
+    checkpoint = get_json(checkpoint_key) or new_checkpoint(partition)
+    checkpoint.update(status='in_progress', lease_owner=uuid.uuid4().hex, heartbeat_at=time.time())
+    put_json(checkpoint_key, checkpoint)
+    return checkpoint['lease_owner']
+
+def coordinate_sync(run_id: str, context):
+    """Create or resume a run and fan its unfinished partitions out to workers"""
+    run_id = run_id or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    manifest = get_json(run_key(run_id, 'manifest.json'))
+    if manifest is None:
+        auth_header = create_auth_header(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN)
+        manifest = {
+            'run_id': run_id,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'status': 'running',
+            'partitions': plan_partitions(auth_header)
+        }
+        put_json(run_key(run_id, 'manifest.json'), manifest)
+        logger.info(f"Planned run {run_id} with {len(manifest['partitions'])} partitions")
+    else:
+        logger.info(f"Resuming run {run_id} ({manifest['status']})")
+
+    if manifest['status'] == 'published':
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Run already published', 'run_id': run_id,
+                                'documents': manifest.get('documents')})
+        }
+
+    pending = pending_partitions(run_id, manifest)
+    # Partitions a live worker still holds are left alone so two workers never write one shard
+    available = unleased_partitions(run_id, pending)
+    logger.info(f"{len(pending)} of {len(manifest['partitions'])} partitions pending, "
+                f"{len(pending) - len(available)} held by live workers, fan-out: {SYNC_FANOUT}")
+
+    if SYNC_FANOUT == 'lambda' and pending:
+        lambda_client = boto3.client('lambda')
+        for partition in available:
+            lease_owner = acquire_lease(run_id, partition)
+            lambda_client.invoke(
+                FunctionName=SYNC_WORKER_FUNCTION,
+                InvocationType='Event',
+                Payload=json.dumps({'mode': 'worker', 'run_id': run_id, 'partition': partition,
+                                    'lease_owner': lease_owner})
+            )
+        # The last worker to finish triggers the reduce step
+        return {
+            'statusCode': 202,
+            'body': json.dumps({'message': 'Workers dispatched', 'run_id': run_id, 'dispatched': len(available),
+                                'held_by_live_workers': len(pending) - len(available)})
+        }
+
+    if SYNC_FANOUT == 'process' and available:
+        with ProcessPoolExecutor(max_workers=SYNC_WORKERS, initializer=init_process_worker) as pool:
+            for checkpoint in pool.map(process_partition_task, [(run_id, p) for p in available]):
+                logger.info(f"Partition {checkpoint['partition']}: {checkpoint['documents']} documents")
+    elif SYNC_FANOUT != 'process':
+        for partition in available:
+            checkpoint = process_partition(run_id, partition, context)
+            if checkpoint['status'] != 'done':
+                break
+
+    remaining = pending_partitions(run_id, manifest)
+    if remaining:
+        return {
+            'statusCode': 202,
+            'body': json.dumps({
+                'message': 'Run incomplete, invoke the coordinator again with this run_id to resume',
+                'run_id': run_id,
+                'pending_partitions': len(remaining)
+            })
+        }
+    return reduce_sync(run_id)
+
+def init_process_worker():
+    """
+    Give each pool process its own S3 client instead of one inherited across
+    fork, and split the vCPUs the partition pool leaves free between the
+    pool processes' extraction stages (inline when the pool takes every core)
+    """
+    global s3_client, extraction_stage
+    s3_client = s3_client_from_env()
+    extraction_stage = ProcessStage(extract_page, workers=EXTRACTION_WORKERS or max(1, available_cpus() // SYNC_WORKERS))
+
+def process_partition_task(args):
+    """Process pool entry point"""
+    run_id, partition = args
+    # Pool processes handle several partitions; each checkpoint reports its own extraction
+    extraction_stage.reset_stats()
+    return process_partition(run_id, partition)
+
+def run_worker(event: dict, context):
+    """Lambda worker: process one partition, re-invoke itself if time runs out, reduce when last"""
+    run_id = event['run_id']
+    partition = event['partition']
+    lease_owner = event.get('lease_owner') or uuid.uuid4().hex
+    checkpoint = process_partition(run_id, partition, context, lease_owner=lease_owner, keep_lease=True)
+
+    if checkpoint.get('status') != 'done' and checkpoint.get('lease_owner') != lease_owner:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Partition is held by another worker', 'partition': partition['id']})
+        }
+
+    if checkpoint['status'] != 'done':
+        # The continuation keeps this invocation's lease, so the coordinator will not re-dispatch it
+        boto3.client('lambda').invoke(
+            FunctionName=SYNC_WORKER_FUNCTION,
+            InvocationType='Event',
+            Payload=json.dumps({**event, 'lease_owner': lease_owner})
+        )
+        return {
+            'statusCode': 202,
+            'body': json.dumps({'message': 'Partition continued in a new invocation', 'checkpoint': checkpoint})
+        }
+
+    manifest = get_json(run_key(run_id, 'manifest.json'))
+    if not pending_partitions(run_id, manifest):
+        # Reduce is idempotent, so two workers finishing together is harmless
+        return reduce_sync(run_id)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message': 'Partition complete', 'checkpoint': checkpoint})
+    }
+
+def process_partition(run_id: str, partition: dict, context=None, lease_owner: str = None,
+                      keep_lease: bool = False) -> dict:
+    """
+    Fetch and extract one partition in batches. After each batch the shard is
+    written first and the checkpoint second, so a checkpoint never points past
+    documents that were saved. A rerun resumes from checkpoint['next_start'].
+
+    The checkpoint doubles as a lease: it names the owner and carries a heartbeat
+    refreshed every batch. A partition freshly held by another owner is left
+    alone, and a worker whose lease was taken over stops before its next batch.
+    A pause for time releases the lease unless keep_lease is set for a
+    continuation that resumes it. An exception marks the partition failed and
+    releases the lease before it propagates.
+    """
+    checkpoint_key = run_key(run_id, 'checkpoints', f"{partition['id']}.json")
+    shard_key = run_key(run_id, 'shards', f"{partition['id']}.json")
+
+    checkpoint = get_json(checkpoint_key) or new_checkpoint(partition)
+    if checkpoint['status'] == 'done':
+        return checkpoint
+    if lease_is_fresh(checkpoint) and checkpoint.get('lease_owner') != lease_owner:
+        logger.warning(f"Partition {partition['id']} is held by another worker, skipping")
+        return checkpoint
+    checkpoint.update(status='in_progress', lease_owner=lease_owner or uuid.uuid4().hex, heartbeat_at=time.time())
+    checkpoint.pop('error', None)
+    put_json(checkpoint_key, checkpoint)
+
+    # A shard written just before an interruption may run ahead of its checkpoint
+    docs = get_json(shard_key, [])[:checkpoint['documents']] if checkpoint['documents'] else []
+    end = partition['start'] + partition['limit']
+    auth_header = create_auth_header(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN)
+    pages_url = f"{CONFLUENCE_BASE_URL}/wiki/rest/api/content"
+
+    try:
+        while checkpoint['next_start'] < end:
+            if out_of_time(context):
+                logger.warning(f"Partition {partition['id']} paused at {checkpoint['next_start']}, time nearly up")
+                if not keep_lease:
+                    checkpoint['status'] = 'paused'
+                    put_json(checkpoint_key, checkpoint)
+                return checkpoint
+            if get_json(checkpoint_key, {}).get('lease_owner') != checkpoint['lease_owner']:
+                logger.warning(f"Partition {partition['id']} was taken over by another worker, stopping")
+                return get_json(checkpoint_key, checkpoint)
+
+            params = {
+                'spaceKey': partition['space'],
+                'expand': PAGE_EXPAND,
+                'start': checkpoint['next_start'],
+                'limit': min(SYNC_BATCH_SIZE, end - checkpoint['next_start'])
+            }
+            pages_response = make_request(pages_url, auth_header, params)
+            if pages_response['status_code'] != 200:
+                raise RuntimeError(f"Failed to get pages for {partition['id']} at {checkpoint['next_start']}: "
+                                   f"{pages_response['status_code']}")
+
+            pages = pages_response['data'].get('results', [])
+            extracted_pages = extraction_stage.map([page_html(page) for page in pages])
+            for extracted, page in zip(extracted_pages, pages):
+                try:
+                    if isinstance(extracted, StageError):
+                        raise extracted
+                    doc = build_document(page, partition['space'], extracted)
+                    if doc is not None:
+                        docs.append(doc)
+                        if SYNC_ATTACHMENTS:
+                            docs.extend(build_attachment_documents(doc, auth_header))
+                except Exception as e:
+                    logger.error(f"Error processing page {page.get('title', 'unknown')}: {str(e)}")
+
+            # Confluence may return fewer pages than asked for, so advance by what came back
+            has_more = bool(pages) and 'next' in pages_response['data'].get('_links', {})
+            checkpoint['next_start'] = checkpoint['next_start'] + len(pages) if has_more else end
+            checkpoint['documents'] = len(docs)
+            checkpoint['heartbeat_at'] = time.time()
+
+            put_json(shard_key, docs)
+            put_json(checkpoint_key, checkpoint)
+    except BaseException as e:
+        # Release the lease so a resumed run retries the partition right away instead
+        # of waiting out SYNC_LEASE_SECONDS; progress stays at the last saved checkpoint
+        try:
+            stored = get_json(checkpoint_key, {})
+            if stored.get('lease_owner') == checkpoint['lease_owner']:
+                stored.update(status='failed', error=f"{type(e).__name__}: {e}")
+                stored.pop('lease_owner', None)
+                put_json(checkpoint_key, stored)
+        except Exception as release_error:
+            logger.error(f"Could not release partition {partition['id']}: {str(release_error)}")
+        raise
+
+    checkpoint['status'] = 'done'
+    checkpoint['completed_at'] = datetime.now(timezone.utc).isoformat()
+    checkpoint['extraction'] = extraction_stage.report()
+    put_json(checkpoint_key, checkpoint)
+    logger.info(f"Partition {partition['id']} done: {checkpoint['documents']} documents, "
+                f"extraction {checkpoint['extraction']['items_per_core_second']} pages/core/s")
+    return checkpoint
+
+def reduce_sync(run_id: str):
+    """Merge finished shards in partition order and publish the index"""
+    manifest = get_json(run_key(run_id, 'manifest.json'))
+    if manifest is None:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'error': f'Unknown sync run: {run_id}'})
+        }
+
+    remaining = pending_partitions(run_id, manifest)
+    if remaining:
+        return {
+            'statusCode': 409,
+            'body': json.dumps({
+                'error': 'Cannot reduce an incomplete run',
+                'run_id': run_id,
+                'pending_partitions': [p['id'] for p in remaining]
+            })
+        }
+
+    confluence_docs = []
+    seen_ids = set()
+    for partition in manifest['partitions']:
+        for doc in get_json(run_key(run_id, 'shards', f"{partition['id']}.json"), []):
+            # Pages can shift between ranges while a run is in flight
+            if doc['id'] not in seen_ids:
+                seen_ids.add(doc['id'])
+                confluence_docs.append(doc)
+
+    publish_index(confluence_docs)
+    manifest['status'] = 'published'
+    manifest['published_at'] = datetime.now(timezone.utc).isoformat()
+    manifest['documents'] = len(confluence_docs)
+    put_json(run_key(run_id, 'manifest.json'), manifest)
+
+    logger.info(f"=== RUN {run_id} PUBLISHED: {len(confluence_docs)} documents ===")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': f'Successfully synced {len(confluence_docs)} documents',
+            'documents': len(confluence_docs),
+            'run_id': run_id,
+            'partitions': len(manifest['partitions'])
+        })
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Confluence sync locally")
+    parser.add_argument('--mode', default='coordinator', choices=['single', 'coordinator', 'reduce'])
+    parser.add_argument('--run-id', default=None, help="Resume or reduce an existing run")
+    parser.add_argument('--fanout', default='process', choices=['process', 'inline'])
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS)
+    args = parser.parse_args()
+
+    SYNC_FANOUT = args.fanout
+    SYNC_WORKERS = args.workers
+    print(json.dumps(lambda_handler({'mode': args.mode, 'run_id': args.run_id}, None), indent=2))
@@ -0,0 +1,138 @@
+import json
+import os
+import argparse
+import logging
+from collections import defaultdict
+
+from confluence_local import LocalS3Client, list_keys
+from confluence_scripts import percentile
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def load_reports(source: str, bucket: str, prefix: str) -> list:
+    """Load profile reports from a local stand-in directory or from S3"""
+    if source == 's3':
+        import boto3
+        s3_client = boto3.client('s3')
+    else:
+        s3_client = LocalS3Client(source)
+
+    reports = []
+    for key in list_keys(s3_client, bucket, prefix):
+        if not key.endswith('.json'):
+            continue
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+            reports.append(json.loads(response['Body'].read().decode('utf-8')))
+        except Exception as e:
+            logger.error(f"Skipping unreadable report {key}: {str(e)}")
+    return reports
+
+
+def is_ok_status(status) -> bool:
+    """'ok' or any 2xx statusCode; the sync answers 202 while a run is still in progress"""
+    return status == 'ok' or (isinstance(status, str) and len(status) == 3 and status.startswith('2'))
+
+
+def aggregate_reports(reports: list, top_n: int = 15) -> dict:
+    """Merge per-invocation reports into per-function summaries"""
+    by_function = defaultdict(list)
+    for report in reports:
+        by_function[report.get('function', 'unknown')].append(report)
+
+    summary = {}
+    for function_name, items in by_function.items():
+        hotspots = defaultdict(lambda: {'invocations': 0, 'ncalls': 0, 'tottime_ms': 0.0, 'cumtime_ms': 0.0})
+        allocations = defaultdict(lambda: {'invocations': 0, 'total_bytes': 0, 'max_bytes': 0})
+
+        for report in items:
+            for hotspot in report.get('hotspots', []):
+                entry = hotspots[hotspot['function']]
+                entry['invocations'] += 1
+                entry['ncalls'] += hotspot['ncalls']
+                entry['tottime_ms'] += hotspot['tottime_ms']
+                entry['cumtime_ms'] += hotspot['cumtime_ms']
+            # Older reports called retained allocations 'allocations'
+            for allocation in report.get('retained_allocations', report.get('allocations', [])):
+                entry = allocations[allocation['site']]
+                entry['invocations'] += 1
+                entry['total_bytes'] += allocation['size_bytes']
+                entry['max_bytes'] = max(entry['max_bytes'], allocation['size_bytes'])
+
+        durations = [r.get('duration_ms', 0) for r in items]
+        peaks = [r.get('peak_memory_bytes', 0) for r in items]
+        summary[function_name] = {
+            'invocations': len(items),
+            'errors': sum(1 for r in items if not is_ok_status(r.get('status'))),
+            'duration_ms': {
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'max': max(durations)
+            },
+            'peak_memory_mb': {
+                'p50': round(percentile(peaks, 50) / (1024 * 1024), 2),
+                'max': round(max(peaks) / (1024 * 1024), 2)
+            },
+            'hotspots': sorted(
+                ({'function': name, **values} for name, values in hotspots.items()),
+                key=lambda x: x['tottime_ms'], reverse=True
+            )[:top_n],
+            'allocations': sorted(
+                ({'site': site, **values} for site, values in allocations.items()),
+                key=lambda x: x['max_bytes'], reverse=True
+            )[:top_n]
+        }
+    return summary
+
+
+def print_summary(summary: dict):
+    """Print the aggregated summary as plain-text tables"""
+    for function_name, data in sorted(summary.items()):
+        print(f"\n=== {function_name} ({data['invocations']} invocations, {data['errors']} non-OK) ===")
+        print(f"duration ms: p50={data['duration_ms']['p50']:.1f} p95={data['duration_ms']['p95']:.1f} "
+              f"max={data['duration_ms']['max']:.1f}")
+        print(f"peak memory MB: p50={data['peak_memory_mb']['p50']} max={data['peak_memory_mb']['max']}")
+
+        print("\nTop hotspots (summed self time):")
+        print(f"{'tottime ms':>12} {'cumtime ms':>12} {'ncalls':>10} {'seen':>5}  function")
+        for hotspot in data['hotspots']:
+            print(f"{hotspot['tottime_ms']:>12.1f} {hotspot['cumtime_ms']:>12.1f} {hotspot['ncalls']:>10} "
+                  f"{hotspot['invocations']:>5}  {hotspot['function']}")
+
+        print("\nTop retained allocation sites at handler exit (largest single invocation):")
+        print(f"{'max KB':>12} {'avg KB':>12} {'seen':>5}  site")
+        for allocation in data['allocations']:
+            avg_kb = allocation['total_bytes'] / allocation['invocations'] / 1024
+            print(f"{allocation['max_bytes'] / 1024:>12.1f} {avg_kb:>12.1f} {allocation['invocations']:>5}  "
+                  f"{allocation['site']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate Lambda profile reports across invocations")
+    parser.add_argument('--source', default=os.getenv("LOCAL_STAND_IN_DIR") or 's3',
+                        help="'s3' or a local stand-in directory (default: LOCAL_STAND_IN_DIR or s3)")
+    parser.add_argument('--bucket', default=os.getenv("PROFILE_S3_BUCKET") or os.getenv("S3_BUCKET_NAME"),
+                        help="Bucket holding the reports")
+    parser.add_argument('--prefix', default=os.getenv("PROFILE_S3_PREFIX", "profiles/"),
+                        help="Key prefix, e.g. profiles/confluence-ai-query/2026/10/")
+    parser.add_argument('--top', type=int, default=15, help="Rows per table")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    reports = load_reports(args.source, args.bucket, args.prefix)
+    if not reports:
+        print("No profile reports found")
+        return
+
+    summary = aggregate_reports(reports, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from confluence_scripts import load_script, percentile
+
+# The query module creates its AWS clients at import time
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+def build_synthetic_set(num_docs: int, num_queries: int, seed: int):
+    """
+    Build a labeled corpus. Each query targets one fresh page whose title and body
+    contain the query terms side by side. Distractors mention the same terms
+    scattered through long bodies, and stale copies live in an ARCHIVE space.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    now = datetime.now(timezone.utc)
+
+    def timestamp(days_ago):
+        return (now - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def filler(n):
+        return ' '.join(rng.choice(vocabulary) for _ in range(n))
+
+    docs = []
+    labeled_queries = []
+    for q in range(num_queries):
+        terms = [f"topic{q}a", f"topic{q}b", f"topic{q}c"]
+        target_id = len(docs)
+        docs.append({
+            'id': str(target_id), 'title': f"{terms[0]} {terms[1]} guide",
+            'content': f"{filler(200)} {' '.join(terms)} {filler(200)}",
+            'url': '', 'space': 'ENG', 'last_modified': timestamp(rng.randint(1, 60))
+        })
+        # Stale archived copy with identical lexical score
+        docs.append({
+            'id': str(len(docs)), 'title': f"{terms[0]} {terms[1]} guide",
+            'content': f"{filler(200)} {' '.join(terms)} {filler(200)}",
+            'url': '', 'space': 'ARCHIVE', 'last_modified': timestamp(rng.randint(700, 1500))
+        })
+        # Distractors that mention the terms far apart
+        for _ in range(3):
+            docs.append({
+                'id': str(len(docs)), 'title': f"{terms[0]} {filler(2)}",
+                'content': f"{terms[2]} {filler(300)} {terms[1]} {filler(300)} {terms[0]}",
+                'url': '', 'space': rng.choice(['ENG', 'OPS']), 'last_modified': timestamp(rng.randint(1, 400))
+            })
+        labeled_queries.append({'query': ' '.join(terms), 'relevant': {target_id}})
+
+    while len(docs) < num_docs:
+        docs.append({
+            'id': str(len(docs)), 'title': filler(4), 'content': filler(rng.randint(100, 600)),
+            'url': '', 'space': rng.choice(['ENG', 'OPS', 'HR']), 'last_modified': timestamp(rng.randint(1, 900))
+        })
+
+    # Shuffle so neither pipeline benefits from index order on score ties
+    order = list(range(len(docs)))
+    rng.shuffle(order)
+    new_position = {old: new for new, old in enumerate(order)}
+    docs = [docs[old] for old in order]
+    for item in labeled_queries:
+        item['relevant'] = {new_position[doc_id] for doc_id in item['relevant']}
+    return docs, labeled_queries
+
+
+def baseline_rank(query_module, query: str, content_index: list, top_k: int) -> list:
+    """Previous single-stage search: score every doc, copy it into a result list, sort all of it"""
+    query_words = query.lower().split()
+    results = []
+    for doc_id, doc in enumerate(content_index):
+        score = query_module.lexical_score(query_words, doc)
+        if score > 0:
+            results.append({'doc_id': doc_id, 'content': doc.get('content', ''), 'score': score})
+    results.sort(key=lambda x: x['score'], reverse=True)
+    return [(r['score'], r['doc_id']) for r in results[:top_k]]
+
+
+def evaluate(name: str, rank, labeled_queries: list, top_k: int) -> dict:
+    """Run every labeled query and report latency percentiles, MRR and recall@k"""
+    latencies = []
+    reciprocal_ranks = []
+    hits = 0
+    for item in labeled_queries:
+        started = time.perf_counter()
+        ranked = rank(item['query'])
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        ranked_ids = [doc_id for _, doc_id in ranked[:top_k]]
+        first_hit = next((i for i, doc_id in enumerate(ranked_ids, 1) if doc_id in item['relevant']), None)
+        reciprocal_ranks.append(1 / first_hit if first_hit else 0.0)
+        hits += 1 if first_hit else 0
+
+    return {
+        'pipeline': name,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'mrr': round(sum(reciprocal_ranks) / len(reciprocal_ranks), 4),
+        f'recall@{top_k}': round(hits / len(labeled_queries), 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency/quality benchmark for query retrieval on a labeled synthetic set")
+    parser.add_argument('--docs', type=int, default=5000, help="Corpus size")
+    parser.add_argument('--queries', type=int, default=200, help="Number of labeled queries")
+    parser.add_argument('--candidates', type=int, default=50, help="Stage 1 candidate count")
+    parser.add_argument('--top-k', type=int, default=5, help="Results kept per query")
+    parser.add_argument('--weights', default=None, help="Reranker weights as JSON, overrides RERANK_WEIGHTS")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    query_module = load_script('confluence_ai_query', 'confluence-ai-query.py')
+    query_module.SPACE_PRIORS.setdefault('ARCHIVE', 0.0)
+    # The synthetic corpus has no published trigram index
+    query_module.TYPO_EXPANSION = False
+    weights = {**query_module.RERANK_WEIGHTS, **json.loads(args.weights)} if args.weights else None
+
+    docs, labeled_queries = build_synthetic_set(args.docs, args.queries, args.seed)
+    print(f"Corpus: {len(docs)} docs, {len(labeled_queries)} labeled queries")
+
+    runs = [
+        evaluate('single-stage', lambda q: baseline_rank(query_module, q, docs, args.top_k),
+                 labeled_queries, args.top_k),
+        evaluate('two-stage', lambda q: query_module.rank_documents(
+                     q, docs, candidates=args.candidates, top_k=args.top_k, weights=weights),
+                 labeled_queries, args.top_k),
+    ]
+    for run in runs:
+        print(json.dumps(run))
+
+
+if __name__ == "__main__":
+    main()
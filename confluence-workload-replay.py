@@ -0,0 +1,309 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tracemalloc
+
+from confluence_scripts import load_script, percentile
+
+WORKLOAD_MARKER = 'QUERY_WORKLOAD '
+
+EMAIL_PATTERN = re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b')
+URL_PATTERN = re.compile(r'https?://\S+')
+TOKEN_PATTERN = re.compile(r'\b(?=[A-Za-z0-9]*\d)[A-Za-z0-9_-]{20,}\b')
+NUMBER_PATTERN = re.compile(r'\b\d{5,}\b')
+
+
+def anonymize_query(text: str) -> str:
+    """Mask emails, URLs, long tokens and long numbers while keeping the query's shape"""
+    text = EMAIL_PATTERN.sub('<email>', text)
+    text = URL_PATTERN.sub('<url>', text)
+    text = TOKEN_PATTERN.sub('<token>', text)
+    return NUMBER_PATTERN.sub('<number>', text)
+
+
+def anonymize_session(session_id):
+    """Stable pseudonym that still satisfies the session id format"""
+    if not session_id:
+        return None
+    return hashlib.sha256(session_id.encode('utf-8')).hexdigest()[:24]
+
+
+def parse_workload_line(line: str):
+    """Pull the QUERY_WORKLOAD payload out of a raw or exported CloudWatch log line"""
+    position = line.find(WORKLOAD_MARKER)
+    if position < 0:
+        return None
+    try:
+        payload = json.loads(line[position + len(WORKLOAD_MARKER):].strip())
+    except json.JSONDecodeError:
+        return None
+    return {
+        'timestamp': payload.get('timestamp'),
+        'query': anonymize_query(payload.get('query', '')),
+        'filters': payload.get('filters'),
+        'session_id': anonymize_session(payload.get('session_id'))
+    }
+
+
+def read_log_group(log_group: str, since_hours: float):
+    """Yield workload lines from CloudWatch Logs"""
+    import boto3
+    logs_client = boto3.client('logs')
+    paginator = logs_client.get_paginator('filter_log_events')
+    start_time = int((time.time() - since_hours * 3600) * 1000)
+    for page in paginator.paginate(logGroupName=log_group, startTime=start_time,
+                                   filterPattern=f'"{WORKLOAD_MARKER.strip()}"'):
+        for log_event in page.get('events', []):
+            yield log_event['message']
+
+
+def record(args):
+    """Build an anonymized JSONL workload from log files or a CloudWatch log group"""
+    lines = []
+    for path in args.log_file or []:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            lines.extend(f)
+    if args.log_group:
+        lines.extend(read_log_group(args.log_group, args.since_hours))
+
+    workload = [item for item in (parse_workload_line(line) for line in lines) if item and item['query']]
+    workload.sort(key=lambda item: item['timestamp'] or 0)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for item in workload:
+            f.write(json.dumps(item) + '\n')
+    print(f"Recorded {len(workload)} queries to {args.output}")
+
+
+def load_query_module(stand_in_dir: str, bedrock_latency_ms: float):
+    """Import the query Lambda wired to the local S3 and Bedrock stand-ins"""
+    os.environ['LOCAL_STAND_IN_DIR'] = stand_in_dir
+    os.environ['BEDROCK_STAND_IN'] = 'fake'
+    os.environ['BEDROCK_STAND_IN_LATENCY_MS'] = str(bedrock_latency_ms)
+    os.environ.setdefault('S3_BUCKET_NAME', 'replay')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['PROFILE_ENABLED'] = 'false'
+    os.environ['PROFILE_SAMPLE_RATE'] = '0'
+    return load_script('confluence_ai_query', 'confluence-ai-query.py')
+
+
+def index_exists(query_module) -> bool:
+    try:
+        query_module.s3_client.get_object(Bucket=query_module.S3_BUCKET, Key='confluence-index.json')
+        return True
+    except Exception:
+        return False
+
+
+def seed_synthetic_index(query_module, num_docs: int):
+    """
+    Publish a synthetic corpus into the stand-in when it has no index, through the
+    sync's publish_index so the filter, vocabulary and trigram artifacts exist too
+    """
+    if index_exists(query_module):
+        return
+    from confluence_extraction import tokenize
+    benchmark = load_script('confluence_retrieval_benchmark', 'confluence-retrieval-benchmark.py')
+    sync = load_script('confluence_data_sync', 'confluence-data-sync.py')
+    docs, _ = benchmark.build_synthetic_set(num_docs, max(1, num_docs // 25), seed=7)
+    for doc in docs:
+        doc['terms'] = sorted(set(tokenize(doc['content'])))
+    sync.publish_index(docs)
+    print(f"Seeded stand-in with a synthetic index of {len(docs)} documents")
+
+
+def replay_pass(query_module, workload: list, speed: float, trace_allocations: bool) -> list:
+    """
+    Invoke lambda_handler once per workload item. With speed > 0 the recorded
+    inter-arrival gaps are kept, divided by speed; 0 replays back to back.
+    """
+    records = []
+    if not workload:
+        return records
+    # Fresh sessions per pass so follow-ups behave as they did when recorded
+    query_module.session_store = query_module.session_store_from_env(query_module.s3_client, query_module.S3_BUCKET)
+    first_timestamp = workload[0].get('timestamp') or 0
+    started = time.perf_counter()
+    if trace_allocations:
+        tracemalloc.start()
+
+    try:
+        for item in workload:
+            if speed > 0 and item.get('timestamp'):
+                delay = (item['timestamp'] - first_timestamp) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            event = {'body': json.dumps({
+                key: value for key, value in
+                (('query', item['query']), ('filters', item.get('filters')), ('session_id', item.get('session_id')))
+                if value
+            })}
+            if trace_allocations:
+                tracemalloc.reset_peak()
+                baseline_bytes = tracemalloc.get_traced_memory()[0]
+
+            request_started = time.perf_counter()
+            response = query_module.lambda_handler(event, None)
+            latency_ms = (time.perf_counter() - request_started) * 1000
+
+            record = {'latency_ms': latency_ms, 'status': response.get('statusCode')}
+            try:
+                body = json.loads(response['body'])
+            except (KeyError, ValueError):
+                body = {}
+            record['stages_ms'] = body.get('timings_ms', {})
+            # search_confluence_content answers [] on errors; a fresh retrieval without an index load is one
+            record['search_failed'] = body.get('retrieval') == 'fresh' and 'index_load' not in record['stages_ms']
+            if trace_allocations:
+                record['alloc_peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline_bytes
+            records.append(record)
+    finally:
+        if trace_allocations:
+            tracemalloc.stop()
+    return records
+
+
+def summarize(timing_records: list, allocation_records: list) -> dict:
+    latencies = [r['latency_ms'] for r in timing_records]
+    stages = {}
+    for r in timing_records:
+        for stage, ms in r['stages_ms'].items():
+            stages.setdefault(stage, []).append(ms)
+
+    summary = {
+        'requests': len(timing_records),
+        'errors': sum(1 for r in timing_records if r['status'] != 200 or r['search_failed']),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3)
+        },
+        'stages_ms': {
+            stage: {'p50': round(percentile(values, 50), 3), 'p95': round(percentile(values, 95), 3)}
+            for stage, values in sorted(stages.items())
+        }
+    }
+    if allocation_records:
+        peaks = [r['alloc_peak_bytes'] / 1024 for r in allocation_records]
+        summary['alloc_peak_kb'] = {
+            'p50': round(percentile(peaks, 50), 1),
+            'p95': round(percentile(peaks, 95), 1),
+            'max': round(max(peaks), 1)
+        }
+    return summary
+
+
+def compare(current: dict, baseline: dict, max_regression: float, max_alloc_regression: float,
+            min_delta_ms: float) -> list:
+    """Threshold violations; deltas under min_delta_ms are treated as noise"""
+    failures = []
+
+    def check(label, now, before, limit, floor):
+        if before is None or now is None:
+            return
+        if now - before > floor and now > before * (1 + limit):
+            failures.append(f"{label}: {before} -> {now} (+{(now / before - 1) * 100 if before else float('inf'):.0f}%, "
+                            f"limit {limit * 100:.0f}%)")
+
+    for pct in ('p50', 'p95', 'p99'):
+        check(f"latency {pct} ms", current['latency_ms'][pct], baseline['latency_ms'].get(pct),
+              max_regression, min_delta_ms)
+    for stage, values in current['stages_ms'].items():
+        before = baseline.get('stages_ms', {}).get(stage, {})
+        check(f"stage {stage} p95 ms", values['p95'], before.get('p95'), max_regression, min_delta_ms)
+    if 'alloc_peak_kb' in current and 'alloc_peak_kb' in baseline:
+        for pct in ('p50', 'p95'):
+            check(f"alloc peak {pct} KB", current['alloc_peak_kb'][pct], baseline['alloc_peak_kb'].get(pct),
+                  max_alloc_regression, 16)
+    if current['errors'] > baseline.get('errors', 0):
+        failures.append(f"errors: {baseline.get('errors', 0)} -> {current['errors']}")
+    return failures
+
+
+def replay(args):
+    """Replay a workload, optionally save it as the baseline or gate it against one"""
+    with open(args.workload, encoding='utf-8') as f:
+        workload = [json.loads(line) for line in f if line.strip()]
+    if args.limit:
+        workload = workload[:args.limit]
+    if not workload:
+        print("Workload is empty")
+        return 1
+
+    query_module = load_query_module(args.stand_in, args.bedrock_latency_ms)
+    if args.seed_synthetic_docs:
+        seed_synthetic_index(query_module, args.seed_synthetic_docs)
+    if not index_exists(query_module):
+        # Without an index every search returns [] in microseconds, which would make a useless baseline
+        print(f"No confluence-index.json in s3://{query_module.S3_BUCKET} under {args.stand_in}; "
+              f"publish one or pass --seed-synthetic-docs")
+        return 1
+
+    # Warm the container state (imports, caches) before measuring
+    replay_pass(query_module, workload[:args.warmup], 0, False)
+    timing_records = replay_pass(query_module, workload, args.speed, False)
+    # Allocation tracing slows everything down, so it gets its own back-to-back pass
+    allocation_records = [] if args.no_allocations else replay_pass(query_module, workload, 0, True)
+
+    summary = summarize(timing_records, allocation_records)
+    print(json.dumps(summary, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        failures = compare(summary, baseline, args.max_regression, args.max_alloc_regression, args.min_delta_ms)
+        if failures:
+            print("REGRESSION:\n  " + "\n  ".join(failures))
+            return 1
+        print("No regression against baseline")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay query workloads as a latency regression gate")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help="Extract an anonymized workload from query Lambda logs")
+    record_parser.add_argument('--log-file', action='append', help="Exported log file (repeatable)")
+    record_parser.add_argument('--log-group', default=None, help="CloudWatch log group, e.g. /aws/lambda/confluence-ai-query")
+    record_parser.add_argument('--since-hours', type=float, default=24)
+    record_parser.add_argument('--output', default='workload.jsonl')
+
+    replay_parser = subparsers.add_parser('replay', help="Replay a workload against the local stand-ins")
+    replay_parser.add_argument('--workload', default='workload.jsonl')
+    replay_parser.add_argument('--stand-in', default=os.getenv("LOCAL_STAND_IN_DIR", "/tmp/confluence-stand-in"),
+                               help="Local S3 stand-in directory holding the index")
+    replay_parser.add_argument('--seed-synthetic-docs', type=int, default=0,
+                               help="Seed a synthetic index of this many docs if the stand-in has none")
+    replay_parser.add_argument('--speed', type=float, default=0,
+                               help="1 = recorded rate, 2 = twice as fast, 0 = back to back")
+    replay_parser.add_argument('--limit', type=int, default=0)
+    replay_parser.add_argument('--warmup', type=int, default=5)
+    replay_parser.add_argument('--bedrock-latency-ms', type=float, default=0,
+                               help="Simulated Bedrock latency; 0 isolates the query path")
+    replay_parser.add_argument('--no-allocations', action='store_true', help="Skip the tracemalloc pass")
+    replay_parser.add_argument('--save-baseline', default=None)
+    replay_parser.add_argument('--baseline', default=None, help="Fail when this baseline is exceeded")
+    replay_parser.add_argument('--max-regression', type=float, default=0.25)
+    replay_parser.add_argument('--max-alloc-regression', type=float, default=0.25)
+    replay_parser.add_argument('--min-delta-ms', type=float, default=2.0)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args)
+        return 0
+    return replay(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
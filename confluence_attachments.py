@@ -0,0 +1,231 @@
+import io
+import os
+import codecs
+import re
+import json
+import zipfile
+import logging
+import tempfile
+import urllib.request
+import xml.etree.ElementTree as ET
+
+# Optional PDF support - PDFs are skipped when pypdf is not installed
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Configuration - all from environment variables
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+ATTACHMENT_MAX_TEXT_CHARS = int(os.getenv("ATTACHMENT_MAX_TEXT_CHARS", "50000"))
+ATTACHMENT_CACHE_PREFIX = os.getenv("ATTACHMENT_CACHE_PREFIX", "attachment-cache/")
+# Downloads above this size spill from memory to /tmp
+SPOOL_MEMORY_BYTES = 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+
+TEXT_EXTENSIONS = {'.txt', '.md', '.csv', '.log', '.json', '.yaml', '.yml', '.xml', '.ini', '.cfg', '.sql'}
+DOCX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class AttachmentTooLarge(Exception):
+    """Raised when a download exceeds ATTACHMENT_MAX_BYTES"""
+
+
+def attachment_kind(title: str, media_type: str) -> str:
+    """'text', 'docx', 'pdf' or None for formats we do not extract"""
+    extension = os.path.splitext(title.lower())[1]
+    media_type = (media_type or '').lower()
+    if media_type.startswith('text/') or extension in TEXT_EXTENSIONS:
+        return 'text'
+    if media_type == DOCX_MEDIA_TYPE or extension == '.docx':
+        return 'docx'
+    if media_type == 'application/pdf' or extension == '.pdf':
+        return 'pdf'
+    return None
+
+
+def list_attachments(base_url: str, page_id: str, make_request, auth_header: str) -> list:
+    """All attachments of a page, following pagination"""
+    attachments = []
+    url = f"{base_url}/wiki/rest/api/content/{page_id}/child/attachment"
+    params = {'expand': 'version', 'limit': 50, 'start': 0}
+    while True:
+        response = make_request(url, auth_header, params)
+        if response['status_code'] != 200:
+            logger.error(f"Failed to list attachments for page {page_id}: {response['status_code']}")
+            return attachments
+        results = response['data'].get('results', [])
+        attachments.extend(results)
+        if not results or 'next' not in response['data'].get('_links', {}):
+            return attachments
+        params['start'] += len(results)
+
+
+def download_attachment(url: str, auth_header: str):
+    """
+    Stream a download into memory, moving it to a /tmp file once it passes
+    SPOOL_MEMORY_BYTES, and abort once it passes ATTACHMENT_MAX_BYTES. Spooling
+    is done by hand because SpooledTemporaryFile lacks readable()/seekable()
+    before Python 3.11, which zipfile and io wrappers need.
+    """
+    req = urllib.request.Request(url)
+    req.add_header('Authorization', auth_header)
+    req.add_header('User-Agent', 'Lambda-Confluence-Sync/1.0')
+
+    spool = io.BytesIO()
+    size = 0
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            while True:
+                chunk = response.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > ATTACHMENT_MAX_BYTES:
+                    raise AttachmentTooLarge(f"download exceeded {ATTACHMENT_MAX_BYTES} bytes")
+                if size > SPOOL_MEMORY_BYTES and isinstance(spool, io.BytesIO):
+                    on_disk = tempfile.TemporaryFile()
+                    on_disk.write(spool.getbuffer())
+                    spool = on_disk
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def extract_text_stream(fileobj, max_chars: int) -> str:
+    """
+    Decode a text file chunk by chunk, stopping at max_chars, without reading
+    more of the file than needed
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parts = []
+    total = 0
+    while total < max_chars:
+        chunk = fileobj.read(CHUNK_BYTES)
+        text = decoder.decode(chunk, final=not chunk)
+        parts.append(text)
+        total += len(text)
+        if not chunk:
+            break
+    return ''.join(parts)[:max_chars]
+
+
+def extract_docx_stream(fileobj, max_chars: int) -> str:
+    """
+    Pull paragraph text out of word/document.xml with iterparse, clearing each
+    element once read so memory stays flat regardless of document size
+    """
+    parts = []
+    total = 0
+    with zipfile.ZipFile(fileobj) as archive:
+        with archive.open('word/document.xml') as document:
+            for _, elem in ET.iterparse(document, events=('end',)):
+                if elem.tag == f"{WORD_NAMESPACE}t" and elem.text:
+                    parts.append(elem.text)
+                    total += len(elem.text)
+                elif elem.tag == f"{WORD_NAMESPACE}p":
+                    parts.append('\n')
+                    elem.clear()
+                if total >= max_chars:
+                    break
+    return ''.join(parts)
+
+
+def extract_pdf_stream(fileobj, max_chars: int) -> str:
+    """Extract PDF text page by page with pypdf, stopping at max_chars"""
+    if pypdf is None:
+        raise RuntimeError("pypdf is not installed")
+    reader = pypdf.PdfReader(fileobj)
+    parts = []
+    total = 0
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    return '\n'.join(parts)
+
+
+EXTRACTORS = {
+    'text': extract_text_stream,
+    'docx': extract_docx_stream,
+    'pdf': extract_pdf_stream
+}
+
+
+def cache_key(attachment_id: str, version) -> str:
+    """Cache entries are addressed by attachment id and version, so an unchanged attachment maps to the same key"""
+    return f"{ATTACHMENT_CACHE_PREFIX}{attachment_id}-v{version}.json"
+
+
+def get_cached(s3_client, bucket: str, key: str):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except Exception:
+        return None
+
+
+def attachment_text(attachment: dict, base_url: str, auth_header: str, s3_client, bucket: str) -> dict:
+    """
+    Cached extraction result for one attachment: {'text', 'skipped'}. Unsupported,
+    oversized and failed attachments are cached too, so they are not retried
+    until a new version is uploaded.
+    """
+    version = attachment.get('version', {}).get('number', 0)
+    key = cache_key(attachment['id'], version)
+    cached = get_cached(s3_client, bucket, key)
+    if cached is not None:
+        return cached
+
+    title = attachment.get('title', '')
+    media_type = attachment.get('metadata', {}).get('mediaType') or attachment.get('extensions', {}).get('mediaType')
+    file_size = attachment.get('extensions', {}).get('fileSize') or 0
+    kind = attachment_kind(title, media_type)
+
+    entry = {'attachment_id': attachment['id'], 'version': version, 'title': title, 'text': '', 'skipped': None}
+    if kind is None:
+        entry['skipped'] = f"unsupported type {media_type}"
+    elif kind == 'pdf' and pypdf is None:
+        # Not cached, so PDFs are picked up once pypdf is deployed
+        entry['skipped'] = "pypdf not installed"
+        return entry
+    elif file_size > ATTACHMENT_MAX_BYTES:
+        entry['skipped'] = f"size {file_size} over limit"
+    else:
+        download_url = f"{base_url}/wiki{attachment['_links']['download']}"
+        try:
+            fileobj = download_attachment(download_url, auth_header)
+        except AttachmentTooLarge as e:
+            entry['skipped'] = str(e)
+        except Exception as e:
+            # Download failures (URLError, timeouts, mid-stream resets, IncompleteRead)
+            # are not cached so the next sync retries them
+            logger.error(f"Failed to download attachment {title}: {str(e)}")
+            return entry
+        else:
+            with fileobj:
+                try:
+                    text = EXTRACTORS[kind](fileobj, ATTACHMENT_MAX_TEXT_CHARS)
+                    entry['text'] = re.sub(r'\s+', ' ', text).strip()[:ATTACHMENT_MAX_TEXT_CHARS]
+                except Exception as e:
+                    # The file itself is unreadable; cached until a new version is uploaded
+                    logger.error(f"Failed to extract attachment {title}: {str(e)}")
+                    entry['skipped'] = f"extraction failed: {type(e).__name__}"
+
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(entry),
+        ContentType='application/json'
+    )
+    return entry
@@ -0,0 +1,249 @@
+import os
+import re
+import time
+import logging
+import itertools
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Configuration - all from environment variables
+# 0 = one worker per available vCPU (Lambda grants more vCPUs at higher memory settings)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0"))
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "16"))
+# Below this many items a call runs inline; warm workers add well under 0.1 ms per item,
+# so this only keeps tiny calls from forking the pool
+EXTRACTION_MIN_PARALLEL_ITEMS = int(os.getenv("EXTRACTION_MIN_PARALLEL_ITEMS", "8"))
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def available_cpus() -> int:
+    """vCPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def tokenize(text: str) -> list:
+    """Lower-cased alphanumeric tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def character_trigrams(term: str) -> set:
+    """Character trigrams of a term padded with '$' so prefixes and suffixes count"""
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StageError(Exception):
+    """func raised on one item; returned by ProcessStage.map in that item's place"""
+
+    def __init__(self, message: str, details: str = ''):
+        super().__init__(message)
+        self.details = details
+
+
+def _apply(func, item):
+    """func(item), or a StageError carrying the failure so one bad item cannot take down a worker"""
+    try:
+        return func(item)
+    except Exception as e:
+        return StageError(f"{type(e).__name__}: {e}", traceback.format_exc())
+
+
+def _worker_loop(conn, func):
+    """Worker process: receive a batch as one UTF-8 buffer plus offsets, send back results"""
+    while True:
+        try:
+            offsets = conn.recv()
+        except EOFError:
+            break
+        if offsets is None:
+            break
+        buffer = memoryview(conn.recv_bytes())
+        started = time.perf_counter()
+        results = [_apply(func, str(buffer[start:end], 'utf-8', 'surrogatepass')) for start, end in offsets]
+        conn.send((results, time.perf_counter() - started))
+    conn.close()
+
+
+class ProcessStage:
+    """
+    Run a CPU-bound text function over a stream of strings on worker processes
+    and yield results in input order.
+
+    Workers are plain Processes connected by Pipes because Lambda has no
+    /dev/shm, which multiprocessing.Pool and ProcessPoolExecutor need. Each batch
+    crosses the pipe as a single bytes buffer, and each worker has at most one
+    batch in flight, so neither side can block on a full pipe. Workers start on
+    first use and are reused across warm invocations.
+
+    Items for which func raises come back as StageError instances, in inline
+    and worker mode alike, so callers can skip them and keep going.
+    """
+
+    def __init__(self, func, workers: int = None, batch_size: int = None):
+        self.func = func
+        self.workers = workers or EXTRACTION_WORKERS or available_cpus()
+        self.batch_size = batch_size or EXTRACTION_BATCH_SIZE
+        self._processes = []
+        self._connections = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            'items': 0,
+            'inline_items': 0,
+            'failed_items': 0,
+            'bytes': 0,
+            'wall_seconds': 0.0,
+            'busy_seconds': [0.0] * self.workers
+        }
+
+    def _start(self):
+        context = multiprocessing.get_context('fork')
+        for _ in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_loop, args=(child_conn, self.func), daemon=True)
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._connections.append(parent_conn)
+        logger.info(f"Started {self.workers} extraction workers")
+
+    def close(self):
+        """Stop the worker processes"""
+        for conn in self._connections:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+        self._processes = []
+        self._connections = []
+
+    def _batches(self, items, batch_size: int):
+        batch = []
+        for item in items:
+            batch.append(item or '')
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _send(self, conn, batch):
+        # surrogatepass: json.loads accepts lone surrogates in page bodies, and they
+        # must reach func unchanged just as they do inline
+        encoded = [item.encode('utf-8', 'surrogatepass') for item in batch]
+        offsets = []
+        position = 0
+        for chunk in encoded:
+            offsets.append((position, position + len(chunk)))
+            position += len(chunk)
+        conn.send(offsets)
+        conn.send_bytes(b''.join(encoded))
+        self.stats['bytes'] += position
+
+    def map(self, items):
+        """
+        Yield func(item) for each item, in order. `items` may be any iterable and
+        is consumed as batches are dispatched, so callers can stream work across
+        several sources through one call.
+        """
+        started = time.perf_counter()
+        in_flight = {}     # connection -> batch number
+        total = len(items) if hasattr(items, '__len__') else None
+        items = iter(items)
+        try:
+            head = list(itertools.islice(items, EXTRACTION_MIN_PARALLEL_ITEMS))
+            if self.workers <= 1 or len(head) < EXTRACTION_MIN_PARALLEL_ITEMS:
+                for item in itertools.chain(head, items):
+                    item_started = time.perf_counter()
+                    result = _apply(self.func, item or '')
+                    self.stats['busy_seconds'][0] += time.perf_counter() - item_started
+                    self.stats['items'] += 1
+                    self.stats['inline_items'] += 1
+                    self.stats['bytes'] += len(item or '')
+                    self.stats['failed_items'] += isinstance(result, StageError)
+                    yield result
+                return
+
+            if not self._processes:
+                self._start()
+
+            # Spread a known-size call across every worker instead of filling the first few
+            batch_size = self.batch_size if total is None else max(1, min(self.batch_size, -(-total // self.workers)))
+            batches = self._batches(itertools.chain(head, items), batch_size)
+            finished = {}      # batch number -> results, waiting for earlier batches
+            next_to_send = 0
+            next_to_yield = 0
+            exhausted = False
+
+            for conn in self._connections:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                self._send(conn, batch)
+                in_flight[conn] = next_to_send
+                next_to_send += 1
+
+            while in_flight:
+                for conn in wait(list(in_flight)):
+                    results, busy = conn.recv()
+                    worker_index = self._connections.index(conn)
+                    self.stats['busy_seconds'][worker_index] += busy
+                    finished[in_flight.pop(conn)] = results
+
+                    batch = None if exhausted else next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                    else:
+                        self._send(conn, batch)
+                        in_flight[conn] = next_to_send
+                        next_to_send += 1
+
+                while next_to_yield in finished:
+                    results = finished.pop(next_to_yield)
+                    self.stats['items'] += len(results)
+                    self.stats['failed_items'] += sum(isinstance(result, StageError) for result in results)
+                    next_to_yield += 1
+                    yield from results
+        except (EOFError, OSError) as e:
+            # Only a hard crash (OOM kill, segfault) gets here; func errors come back as StageError.
+            # A dead worker leaves the pipes in an unknown state, so restart on next use
+            exit_codes = [process.exitcode for process in self._processes if process.exitcode is not None]
+            in_flight.clear()
+            self.close()
+            raise RuntimeError(f"Extraction worker died (exit codes {exit_codes})") from e
+        finally:
+            # Drain batches still in flight if the caller stopped iterating early
+            for conn in list(in_flight):
+                conn.recv()
+            self.stats['wall_seconds'] += time.perf_counter() - started
+
+    def report(self) -> dict:
+        """Throughput summary since the last reset, including per-core rates"""
+        busy = [round(seconds, 3) for seconds in self.stats['busy_seconds']]
+        total_busy = sum(self.stats['busy_seconds']) or 1e-9
+        wall = self.stats['wall_seconds'] or 1e-9
+        return {
+            'workers': self.workers,
+            'items': self.stats['items'],
+            'inline_items': self.stats['inline_items'],
+            'failed_items': self.stats['failed_items'],
+            'megabytes': round(self.stats['bytes'] / (1024 * 1024), 2),
+            'wall_seconds': round(self.stats['wall_seconds'], 3),
+            'items_per_second': round(self.stats['items'] / wall, 1),
+            'items_per_core_second': round(self.stats['items'] / total_busy, 1),
+            'busy_seconds_per_worker': busy,
+            'parallel_efficiency': round(total_busy / (wall * self.workers), 2)
+        }
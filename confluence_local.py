@@ -0,0 +1,167 @@
+import io
+import os
+import re
+import json
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Root directory for the local stand-ins; unset means talk to real AWS
+LOCAL_STAND_IN_DIR = os.getenv("LOCAL_STAND_IN_DIR")
+# "fake" swaps Bedrock for FakeBedrockClient
+BEDROCK_STAND_IN = os.getenv("BEDROCK_STAND_IN")
+
+
+class NoSuchKey(Exception):
+    """Raised by LocalS3Client.get_object when the key does not exist"""
+
+
+class LocalS3Client:
+    """
+    Filesystem stand-in for the subset of the boto3 S3 client used by the
+    Lambda functions. Objects live at <root>/<bucket>/<key>.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket or '_default', *key.split('/'))
+
+    @staticmethod
+    def _etag(path: str) -> str:
+        # Changes on every write like an S3 ETag, without hashing the whole object
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def head_bucket(self, Bucket: str) -> dict:
+        os.makedirs(os.path.join(self.root, Bucket or '_default'), exist_ok=True)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise NoSuchKey(f"s3://{Bucket}/{Key} does not exist under {self.root}")
+        with open(path, 'rb') as f:
+            data = f.read()
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': self._etag(path)}
+
+    def put_object(self, Bucket: str, Key: str, Body, ContentType: str = None, **kwargs) -> dict:
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        # Write-then-rename so readers never see a half-written object
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(Body)
+        os.replace(tmp_path, path)
+        return {'ETag': self._etag(path)}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        path = self._path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', **kwargs) -> dict:
+        bucket_root = os.path.join(self.root, Bucket or '_default')
+        contents = []
+        for dirpath, _, filenames in os.walk(bucket_root):
+            for filename in filenames:
+                if '.tmp-' in filename:
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                key = os.path.relpath(full_path, bucket_root).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    contents.append({'Key': key, 'Size': os.path.getsize(full_path)})
+        contents.sort(key=lambda x: x['Key'])
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+
+def s3_client_from_env():
+    """Return a LocalS3Client when LOCAL_STAND_IN_DIR is set, otherwise a boto3 S3 client"""
+    if LOCAL_STAND_IN_DIR:
+        logger.info(f"Using local S3 stand-in at {LOCAL_STAND_IN_DIR}")
+        return LocalS3Client(LOCAL_STAND_IN_DIR)
+    import boto3
+    return boto3.client('s3')
+
+
+def list_keys(s3_client, bucket: str, prefix: str) -> list:
+    """List every key under a prefix, following continuation tokens"""
+    keys = []
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**params)
+        keys.extend(item['Key'] for item in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            return keys
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+
+class FakeBedrockClient:
+    """
+    Offline stand-in for bedrock-runtime invoke_model with the Anthropic messages
+    format. Summarization prompts (pages wrapped in <page id="..."> tags) get a
+    JSON answer built from each page's opening sentences; anything else gets a
+    short canned answer naming the context documents. Usage is estimated at
+    four characters per token.
+    """
+
+    PAGE_PATTERN = re.compile(r'<page id="([^"]+)"[^>]*>(.*?)</page>', re.DOTALL)
+    DOCUMENT_PATTERN = re.compile(r'Document \d+: ([^\n]+)')
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def invoke_model(self, modelId: str, body, contentType: str = None, **kwargs) -> dict:
+        self.calls += 1
+        request = json.loads(body)
+        texts = [block['text'] for block in request.get('system', []) if isinstance(block, dict)]
+        for message in request.get('messages', []):
+            content = message.get('content', '')
+            if isinstance(content, str):
+                texts.append(content)
+            else:
+                texts.extend(block.get('text', '') for block in content)
+        prompt = '\n'.join(texts)
+
+        pages = self.PAGE_PATTERN.findall(prompt)
+        if pages:
+            answer = json.dumps({page_id: self._summarize(text) for page_id, text in pages})
+        else:
+            titles = self.DOCUMENT_PATTERN.findall(prompt)
+            answer = (f"Based on {', '.join(titles)}: this is a stand-in answer." if titles
+                      else "The information isn't available in the provided context.")
+
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        response = {
+            'content': [{'type': 'text', 'text': answer}],
+            'usage': {'input_tokens': len(prompt) // 4, 'output_tokens': len(answer) // 4}
+        }
+        return {'body': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+    @staticmethod
+    def _summarize(text: str) -> dict:
+        sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text.strip()) if s.strip()]
+        return {
+            'summary': ' '.join(sentences[:2])[:400],
+            'key_facts': [s[:200] for s in sentences if re.search(r'\d|:', s)][:5]
+        }
+
+
+def bedrock_client_from_env():
+    """Return a FakeBedrockClient when BEDROCK_STAND_IN=fake, otherwise a boto3 bedrock-runtime client"""
+    if BEDROCK_STAND_IN == 'fake':
+        logger.info("Using fake Bedrock stand-in")
+        return FakeBedrockClient(float(os.getenv("BEDROCK_STAND_IN_LATENCY_MS", "0")))
+    import boto3
+    return boto3.client('bedrock-runtime')
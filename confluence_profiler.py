@@ -0,0 +1,137 @@
+import json
+import os
+import time
+import random
+import cProfile
+import pstats
+import functools
+import tracemalloc
+import logging
+from datetime import datetime, timezone
+
+from confluence_local import s3_client_from_env
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Configuration - all from environment variables
+# PROFILE_ENABLED=true profiles every invocation; otherwise PROFILE_SAMPLE_RATE (0.0-1.0) picks a fraction
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_S3_BUCKET = os.getenv("PROFILE_S3_BUCKET") or os.getenv("S3_BUCKET_NAME") or os.getenv("S3_BUCKET")
+PROFILE_S3_PREFIX = os.getenv("PROFILE_S3_PREFIX", "profiles/")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+# Frames kept per allocation traceback; 1 keeps tracemalloc overhead low
+PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "1"))
+
+
+def should_profile() -> bool:
+    """Decide whether this invocation is profiled"""
+    if PROFILE_ENABLED:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def profile_handler(function_name: str):
+    """
+    Wrap a Lambda handler with cProfile and tracemalloc when profiling is
+    enabled for the invocation. The handler's result and exceptions pass
+    through untouched; report failures are only logged.
+
+    tracemalloc only records the peak size, not where it came from, so the
+    snapshot is taken when the handler returns: its sites are allocations the
+    invocation left behind (caches, module state, the result), reported as
+    retained_allocations next to peak_memory_bytes.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not should_profile():
+                return handler(event, context)
+
+            already_tracing = tracemalloc.is_tracing()
+            if not already_tracing:
+                tracemalloc.start(PROFILE_TRACE_FRAMES)
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                profiler.enable()
+                result = handler(event, context)
+                if isinstance(result, dict) and 'statusCode' in result:
+                    status = str(result['statusCode'])
+                return result
+            except Exception:
+                status = 'exception'
+                raise
+            finally:
+                profiler.disable()
+                duration_ms = (time.perf_counter() - started) * 1000
+                try:
+                    snapshot = tracemalloc.take_snapshot()
+                    _, peak_bytes = tracemalloc.get_traced_memory()
+                    if not already_tracing:
+                        tracemalloc.stop()
+                    report = build_report(function_name, context, profiler, snapshot,
+                                          duration_ms, peak_bytes, status)
+                    write_report(report)
+                except Exception as e:
+                    logger.error(f"Failed to write profile report: {str(e)}")
+        return wrapper
+    return decorator
+
+
+def build_report(function_name, context, profiler, snapshot, duration_ms, peak_bytes, status) -> dict:
+    """Reduce raw profiler and snapshot data to the top hotspots and retained allocation sites"""
+    stats = pstats.Stats(profiler)
+    hotspots = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        hotspots.append({
+            'function': f"{os.path.basename(filename)}:{line}({name})",
+            'ncalls': ncalls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3)
+        })
+    hotspots.sort(key=lambda x: x['tottime_ms'], reverse=True)
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    retained_allocations = [
+        {
+            'site': f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+            'size_bytes': stat.size,
+            'count': stat.count
+        }
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]
+    ]
+
+    return {
+        'function': function_name,
+        'request_id': getattr(context, 'aws_request_id', None) or f"local-{int(time.time() * 1000)}",
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'status': status,
+        'duration_ms': round(duration_ms, 3),
+        'peak_memory_bytes': peak_bytes,
+        'memory_limit_mb': getattr(context, 'memory_limit_in_mb', None),
+        'hotspots': hotspots[:PROFILE_TOP_N],
+        'retained_allocations': retained_allocations
+    }
+
+
+def write_report(report: dict) -> str:
+    """Write a report to S3 (or the local stand-in) and return its key"""
+    day = report['timestamp'][:10].replace('-', '/')
+    key = f"{PROFILE_S3_PREFIX}{report['function']}/{day}/{report['request_id']}.json"
+    s3_client_from_env().put_object(
+        Bucket=PROFILE_S3_BUCKET,
+        Key=key,
+        Body=json.dumps(report, separators=(',', ':')),
+        ContentType='application/json'
+    )
+    logger.info(f"Profile report written to {key} ({report['duration_ms']} ms, "
+                f"peak {report['peak_memory_bytes'] / (1024 * 1024):.1f} MB)")
+    return key
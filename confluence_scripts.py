@@ -0,0 +1,22 @@
+import os
+import importlib.util
+
+# Shared helpers for the command-line tools that sit next to the Lambda scripts
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(name: str, filename: str):
+    """Import one of the hyphenated scripts in this directory under a module name"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
@@ -0,0 +1,126 @@
+import os
+import re
+import json
+import time
+import logging
+from collections import OrderedDict
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Configuration - all from environment variables
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+# Sessions kept in each container's memory; least recently used are evicted first
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+# memory = this container only, s3 = shared across containers (local stand-in honours LOCAL_STAND_IN_DIR)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_S3_PREFIX = os.getenv("SESSION_S3_PREFIX", "sessions/")
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def valid_session_id(session_id) -> bool:
+    """Session ids come from the browser, so only accept a safe, bounded format"""
+    return isinstance(session_id, str) and bool(SESSION_ID_PATTERN.match(session_id))
+
+
+def new_session() -> dict:
+    return {'turns': [], 'passages': [], 'filters': None, 'expires_at': 0, 'updated_at': 0}
+
+
+class MemorySessionBackend:
+    """Bounded LRU of sessions in this container"""
+
+    def __init__(self, max_sessions: int = None):
+        self.max_sessions = max_sessions or SESSION_MAX_SESSIONS
+        self._sessions = OrderedDict()
+
+    def get(self, session_id: str) -> dict:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session['expires_at'] < time.time():
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def put(self, session_id: str, session: dict):
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+
+class S3SessionBackend:
+    """
+    Sessions as small JSON objects under SESSION_S3_PREFIX, shared by every
+    container. Expiry is checked on read; pair it with an S3 lifecycle rule
+    on the prefix to delete old objects.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix or SESSION_S3_PREFIX
+
+    def get(self, session_id: str) -> dict:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{session_id}.json")
+            session = json.loads(response['Body'].read().decode('utf-8'))
+        except Exception:
+            return None
+        return session if session.get('expires_at', 0) >= time.time() else None
+
+    def put(self, session_id: str, session: dict):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{session_id}.json",
+            Body=json.dumps(session),
+            ContentType='application/json'
+        )
+
+
+class SessionStore:
+    """
+    In-memory LRU in front of an optional shared backend. With a shared backend
+    another container may have saved newer turns, so the shared copy is always
+    read and the more recently updated of the two wins; the local copy only
+    covers a failed shared read or write.
+    """
+
+    def __init__(self, shared_backend=None):
+        self.memory = MemorySessionBackend()
+        self.shared = shared_backend
+
+    def get(self, session_id: str) -> dict:
+        session = self.memory.get(session_id)
+        if self.shared is not None:
+            shared = self.shared.get(session_id)
+            if shared is not None and (session is None or shared.get('updated_at', 0) >= session.get('updated_at', 0)):
+                session = shared
+                self.memory.put(session_id, session)
+        return session
+
+    def save_turn(self, session_id: str, session: dict, turn: dict, passages: list, filters: dict):
+        """Append a turn, keep only the last SESSION_MAX_TURNS, refresh the TTL and persist"""
+        session['turns'] = (session['turns'] + [turn])[-SESSION_MAX_TURNS:]
+        session['passages'] = passages
+        session['filters'] = filters
+        session['updated_at'] = time.time()
+        session['expires_at'] = session['updated_at'] + SESSION_TTL_SECONDS
+        self.memory.put(session_id, session)
+        if self.shared is not None:
+            try:
+                self.shared.put(session_id, session)
+            except Exception as e:
+                logger.error(f"Failed to persist session {session_id}: {str(e)}")
+
+
+def session_store_from_env(s3_client, bucket: str) -> SessionStore:
+    """Build the store selected by SESSION_BACKEND"""
+    if SESSION_BACKEND == 's3':
+        return SessionStore(S3SessionBackend(s3_client, bucket))
+    return SessionStore()